@@ -186,6 +186,22 @@ class gow(Task):
         assert sys.platform == "win32", "can only build `gow.exe' on Windows"
         sh.run_in_dir("nmake -f Makefile.win", join("src", "dqsd"))
 
+class bench_memory(Task):
+    """Compare memory use of the compact shortcut map with a plain dict."""
+    def make(self):
+        sh.run_in_dir("python3 bench/memory.py", self.dir, self.log.info)
+
+class bench_latency(Task):
+    """Time `go' end-to-end via the Bash driver vs. the saved baseline."""
+    def make(self):
+        sh.run_in_dir("python3 bench/latency.py", self.dir, self.log.info)
+
+class bench_concurrency(Task):
+    """Check that concurrent `go -a' writers don't lose updates."""
+    def make(self):
+        sh.run_in_dir("python3 bench/concurrency.py", self.dir,
+                      self.log.info)
+
 class docs(Task):
     """Regenerate some doc bits from project-info.xml."""
     deps = ["src/trentm.com/project-info.xml"]
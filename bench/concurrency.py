@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Copyright (c) 2002-2008 ActiveState Software.
+# License: MIT License.
+
+"""
+    Stress test concurrent writes to the shortcuts file: start many
+    processes that all call go.setShortcut() at the same moment and check
+    that no update was lost.
+
+    Usage:
+        python bench/concurrency.py [<options>...]
+
+    Options:
+        -n, --writers <n>       number of writer processes (50)
+        --size <n>              number of shortcuts in the store to
+                                start with (1000)
+
+    Each writer adds its own shortcut to a fresh store. Afterwards the
+    shortcuts file must parse and hold every writer's shortcut, plus all
+    the original ones. Exits non-zero if not.
+"""
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+import subprocess
+import xml.dom.minidom
+from os.path import join, dirname, abspath
+
+_libDir = join(dirname(dirname(abspath(__file__))), "lib")
+sys.path.insert(0, _libDir)
+import go
+
+# Run by each writer process: wait for the common start time, then write.
+_gWriterScript = """
+import sys, time
+import go
+name, value, start = sys.argv[1], sys.argv[2], float(sys.argv[3])
+time.sleep(max(0, start - time.time()))
+go.setShortcut(name, value)
+"""
+
+
+def _generateStore(homeDir, size):
+    shortcutsXml = join(homeDir, ".go", "shortcuts.xml")
+    os.makedirs(dirname(shortcutsXml))
+    f = open(shortcutsXml, 'w')
+    try:
+        f.write('<?xml version="1.0" ?><shortcuts version="1.0">')
+        for i in range(size):
+            f.write('<shortcut name="gen%d" '
+                    'value="/srv/builds/project%d/branch-%d/build-%d"/>'
+                    % (i, i % 40, i % 25, i))
+        f.write('</shortcuts>')
+    finally:
+        f.close()
+    return shortcutsXml
+
+
+def main(argv):
+    numWriters = 50
+    size = 1000
+    optlist, args = getopt.getopt(argv[1:], "hn:",
+        ["help", "writers=", "size="])
+    for opt, optarg in optlist:
+        if opt in ("-h", "--help"):
+            sys.stdout.write(__doc__)
+            return 0
+        elif opt in ("-n", "--writers"):
+            numWriters = int(optarg)
+        elif opt == "--size":
+            size = int(optarg)
+
+    workDir = tempfile.mkdtemp()
+    try:
+        homeDir = join(workDir, "home")
+        shortcutsXml = _generateStore(homeDir, size)
+        env = dict(os.environ)
+        env.pop(go._envvar, None)
+        env.update(HOME=homeDir, PYTHONPATH=_libDir)
+
+        # Give all writers time to start up before they write.
+        start = time.time() + 1.0 + numWriters * 0.02
+        writers = [subprocess.Popen([sys.executable, "-c", _gWriterScript,
+                                     "writer%d" % i, "/tmp/writer%d" % i,
+                                     repr(start)], env=env)
+                   for i in range(numWriters)]
+        failed = [i for i, p in enumerate(writers) if p.wait() != 0]
+        elapsed = time.time() - start
+
+        errors = []
+        if failed:
+            errors.append("%d writer(s) failed: %s"
+                          % (len(failed), ", ".join(map(str, failed))))
+        try:
+            dom = xml.dom.minidom.parse(shortcutsXml)
+        except Exception as ex:
+            errors.append("shortcuts file does not parse: %s" % ex)
+        else:
+            values = dict((e.getAttribute("name"), e.getAttribute("value"))
+                          for e in dom.getElementsByTagName("shortcut"))
+            lost = [i for i in range(numWriters)
+                    if values.get("writer%d" % i) != "/tmp/writer%d" % i]
+            if lost:
+                errors.append("%d of %d update(s) lost: %s"
+                              % (len(lost), numWriters,
+                                 ", ".join("writer%d" % i for i in lost)))
+            missing = [i for i in range(size) if "gen%d" % i not in values]
+            if missing:
+                errors.append("%d original shortcut(s) missing"
+                              % len(missing))
+            print("%d/%d writer entries present, %d shortcuts in store "
+                  "(%.2fs)" % (numWriters - len(lost), numWriters,
+                               len(values), elapsed))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    for error in errors:
+        print("error: %s" % error)
+    return errors and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Copyright (c) 2002-2008 ActiveState Software.
+# License: MIT License.
+
+"""
+    Measure the end-to-end latency of `go' as the user sees it: the real
+    Bash driver (go._gDriverFromShell["sh"]) running in a shell, i.e.
+    interpreter startup plus sourcing the GO_SHELL_SCRIPT.
+
+    Usage:
+        python bench/latency.py [<options>...]
+
+    Options:
+        -n, --iterations <n>    number of timed runs per command (100)
+        --sizes <n>,<n>,...     store sizes to test (10,1000,50000)
+        -b, --baseline <path>   baseline file to compare with (default is
+                                latency-baseline.json next to this script)
+        --save-baseline         save the results as the new baseline
+        --tolerance <frac>      allowed p95 slowdown vs. the baseline
+                                before failing (0.25)
+
+    For each store size the commands "go <name>", "go <name>/<sub>",
+    "go -a <name>", "go --list" and a miss ("go <unknown>") are run and
+    p50/p95/p99 wall-clock latencies reported. Exits non-zero if any p95
+    regressed beyond the tolerance (plus 2ms of slack for noise).
+    Baselines are machine specific: save one on the machine you compare
+    on.
+"""
+
+import os
+import sys
+import json
+import getopt
+import shutil
+import tempfile
+import subprocess
+from os.path import join, dirname, abspath
+
+_libDir = join(dirname(dirname(abspath(__file__))), "lib")
+sys.path.insert(0, _libDir)
+import go
+
+_gCommands = [
+    # (<label>, <go arguments>)
+    ("go name", "bench"),
+    ("go name/sub", "bench/sub"),
+    ("go -a", "-a benchadd"),
+    ("go --list", "--list"),
+    ("go miss", "nosuchshortcut"),
+]
+
+
+def _generateStore(homeDir, size, targetDir):
+    shortcutsXml = join(homeDir, ".go", "shortcuts.xml")
+    os.makedirs(dirname(shortcutsXml))
+    f = open(shortcutsXml, 'w')
+    try:
+        f.write('<?xml version="1.0" ?><shortcuts version="1.0">')
+        f.write('<shortcut name="bench" value="%s"/>' % targetDir)
+        for i in range(size - 1):
+            f.write('<shortcut name="gen%d" '
+                    'value="/srv/builds/project%d/branch-%d/build-%d"/>'
+                    % (i, i % 40, i % 25, i))
+        f.write('</shortcuts>')
+    finally:
+        f.close()
+
+
+def _percentile(samples, pct):
+    samples = sorted(samples)
+    index = int(round(pct / 100.0 * (len(samples) - 1)))
+    return samples[index]
+
+
+def _timeCommands(workDir, size, iterations):
+    """Return {<label>: [<seconds>...]} for the commands at this size."""
+    homeDir = join(workDir, "home-%d" % size)
+    targetDir = join(workDir, "target")
+    if not os.path.isdir(join(targetDir, "sub")):
+        os.makedirs(join(targetDir, "sub"))
+    _generateStore(homeDir, size, targetDir)
+
+    # The driver runs `python -m go'.
+    binDir = join(workDir, "bin")
+    if not os.path.isdir(binDir):
+        os.makedirs(binDir)
+        os.symlink(sys.executable, join(binDir, "python"))
+
+    script = [go._gDriverFromShell["sh"], 'cd "%s"' % workDir]
+    for label, args in _gCommands:
+        script.append("go %s >/dev/null 2>&1" % args) # warm up caches
+        script.append('for i in $(seq %d); do' % iterations)
+        script.append('    cd "%s"; s=$EPOCHREALTIME' % workDir)
+        script.append('    go %s >/dev/null 2>&1' % args)
+        script.append('    e=$EPOCHREALTIME; echo "%s $s $e"' % label)
+        script.append('done')
+    env = dict(os.environ)
+    env.pop(go._envvar, None)
+    env.update(HOME=homeDir, PYTHONPATH=_libDir,
+               PATH=binDir + os.pathsep + env.get("PATH", ""))
+    output = subprocess.check_output(["bash", "-c", '\n'.join(script)],
+                                     env=env, universal_newlines=True)
+    timings = {}
+    for line in output.splitlines():
+        label, start, end = line.rsplit(' ', 2)
+        timings.setdefault(label, []).append(
+            float(end.replace(',', '.')) - float(start.replace(',', '.')))
+    return timings
+
+
+def main(argv):
+    iterations = 100
+    sizes = [10, 1000, 50000]
+    baselinePath = join(dirname(abspath(__file__)), "latency-baseline.json")
+    saveBaseline = False
+    tolerance = 0.25
+    optlist, args = getopt.getopt(argv[1:], "hn:b:",
+        ["help", "iterations=", "sizes=", "baseline=", "save-baseline",
+         "tolerance="])
+    for opt, optarg in optlist:
+        if opt in ("-h", "--help"):
+            sys.stdout.write(__doc__)
+            return 0
+        elif opt in ("-n", "--iterations"):
+            iterations = int(optarg)
+        elif opt == "--sizes":
+            sizes = [int(s) for s in optarg.split(',')]
+        elif opt in ("-b", "--baseline"):
+            baselinePath = optarg
+        elif opt == "--save-baseline":
+            saveBaseline = True
+        elif opt == "--tolerance":
+            tolerance = float(optarg)
+
+    baseline = {}
+    if not saveBaseline and os.path.isfile(baselinePath):
+        baseline = json.load(open(baselinePath))
+
+    results = {}
+    regressions = []
+    workDir = tempfile.mkdtemp()
+    try:
+        print("%-8s %-12s %8s %8s %8s  %s"
+              % ("size", "command", "p50(ms)", "p95(ms)", "p99(ms)",
+                 "baseline p95"))
+        for size in sizes:
+            timings = _timeCommands(workDir, size, iterations)
+            for label, args in _gCommands:
+                key = "%d:%s" % (size, label)
+                result = dict((p, _percentile(timings[label], int(p[1:]))
+                                  * 1000.0)
+                              for p in ("p50", "p95", "p99"))
+                results[key] = result
+                note = ""
+                if key in baseline:
+                    limit = baseline[key]["p95"] * (1 + tolerance) + 2.0
+                    note = "%.1f" % baseline[key]["p95"]
+                    if result["p95"] > limit:
+                        note += "  REGRESSION"
+                        regressions.append(key)
+                print("%-8d %-12s %8.1f %8.1f %8.1f  %s"
+                      % (size, label, result["p50"], result["p95"],
+                         result["p99"], note))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    if saveBaseline:
+        f = open(baselinePath, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        print("baseline saved to '%s'" % baselinePath)
+    if regressions:
+        print("%d regression(s): %s" % (len(regressions),
+                                        ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright (c) 2002-2008 ActiveState Software.
+# License: MIT License.
+
+"""
+    Compare the memory used by getShortcuts()' ShortcutMap with a plain
+    dict of the same shortcuts for a large generated store.
+
+    Usage:
+        python bench/memory.py [<num-shortcuts>]
+
+    The default is 200000 shortcuts with targets like
+    "/srv/builds/<project>/<branch>/<job>". Exits non-zero if the
+    ShortcutMap is not at least 3 times smaller.
+"""
+
+import os
+import sys
+import gc
+import tempfile
+import tracemalloc
+from os.path import join, dirname, abspath
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "lib"))
+import go
+
+
+def _generateStore(path, n):
+    f = open(path, 'w')
+    try:
+        f.write('<?xml version="1.0" ?><shortcuts version="1.0">')
+        for i in range(n):
+            project, branch = "project%d" % (i % 40), "branch-%d" % (i % 25)
+            f.write('<shortcut name="%s-%s-%d" '
+                    'value="/srv/builds/%s/%s/build-%d/logs"/>'
+                    % (project, branch, i, project, branch, i))
+        f.write('</shortcuts>')
+    finally:
+        f.close()
+
+
+def _getPlainShortcuts():
+    """The shortcut dictionary as a plain dict of strings."""
+    shortcuts = go.getDefaultShortcuts()
+    for elem in go._iterShortcutsXml(go.getShortcutsFile()):
+        if elem.tag == "shortcut":
+            shortcuts[elem.get("name")] = elem.get("value")
+    return shortcuts
+
+
+def _measure(build):
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def main(argv):
+    n = len(argv) > 1 and int(argv[1]) or 200000
+    tmpDir = tempfile.mkdtemp()
+    os.environ["HOME"] = tmpDir
+    shortcutsXml = go.getShortcutsFile()
+    os.makedirs(dirname(shortcutsXml))
+    _generateStore(shortcutsXml, n)
+
+    shortcuts, compactSize = _measure(go.getShortcuts)
+    plain, plainSize = _measure(_getPlainShortcuts)
+    assert dict(shortcuts.items()) == plain
+
+    ratio = float(plainSize) / compactSize
+    print("shortcuts:   %d" % n)
+    print("dict:        %.1f MB" % (plainSize / 1e6))
+    print("ShortcutMap: %.1f MB" % (compactSize / 1e6))
+    print("reduction:   %.1fx" % ratio)
+    return ratio < 3 and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -11,6 +11,20 @@
                                         # same as "go -c ..."
         go -c|-o|-a|-d|-s ...           # cd, open, add, delete, set
         go --list [<pattern>]           # list matching shortcuts
+        go --list --tag <tag>           # list shortcuts with a tag
+        go --list --namespace <ns>      # list shortcuts in a namespace
+        go --resolve [-0] < paths       # resolve many shortcut paths
+        go --env <shortcut> [<setting>...]  # environment on cd
+        go --whereami [<path>]          # shortcut form of a path
+        go --warm [<pattern>]           # prefetch shortcut dirs' metadata
+        go <shortcut> --find <glob>     # cd to the dir with a file
+        go --pick [<query>]             # pick a dir interactively
+        go --each [<pattern>] -- <command>...   # run in shortcut dirs
+        go --du [<pattern>]             # disk usage of shortcut dirs
+        some-command | go --shorten     # shorten paths in output
+        go --subscribe <url>            # use a shared shortcut catalog
+        go --sync-export [<since>] > changes.xml    # sync between machines
+        go --sync-apply changes.xml
 
     Options:
         -h, --help                      print this help and exit
@@ -23,6 +37,89 @@
         -o, --open <path>               open the given shortcut path in
                                         explorer (Windows only)
         -l, --list [<pattern>]          list current shortcuts
+        -t, --tag <tag>                 with --list, only list shortcuts
+                                        with this tag; with --set or
+                                        --add-current, tag the shortcut
+                                        (use "-<tag>" to remove a tag)
+        -g, --group <group>             with --list, only list this group;
+                                        with --set or --add-current, put
+                                        the shortcut in this group
+        -n, --namespace <ns>            with --list, list the shortcuts in
+                                        the given namespace
+        --rule <rule>[:<glob>]          with --set, make the shortcut
+                                        computed (see below): <rule> is
+                                        "newest", "greatest" or "date"
+                                        ("none" to make it plain again)
+        --ttl <secs>                    with --rule, the number of seconds
+                                        to reuse a computed target
+                                        (default 60)
+        --resolve                       read shortcut paths from stdin (one
+                                        per line) and write the resolved
+                                        absolute paths to stdout
+        -0, --null                      with --resolve, records on stdin
+                                        and stdout are NUL-separated
+        -e, --env <shortcut> [<setting>...]
+                                        show or change the environment
+                                        profile applied on cd'ing to the
+                                        shortcut. A <setting> is one of:
+                                          NAME=VALUE    set NAME
+                                          -NAME         unset NAME
+                                          NAME+=DIR     prepend DIR to NAME
+                                                        (e.g. PATH+=DIR)
+                                          source:SCRIPT source SCRIPT
+                                          -             clear the profile
+        -w, --whereami [<path>]         print the given path (default is
+                                        the current dir) in its shortest
+                                        <shortcut>/<subpath> form
+        --prompt-func                   print a shell function for using
+                                        `go --whereami' in your prompt
+        --find <glob>                   cd to the dir containing the file
+                                        (or dir) under the given shortcut
+                                        path matching the glob, or list
+                                        the matches if there are several
+        --pick [<query>]                interactively pick the dir to cd
+                                        to from the shortcuts and the dirs
+                                        under them (and under $GO_CDPATH)
+                                        matching the query
+        --each [<pattern>] -- <command>...
+                                        run the command in the target dir
+                                        of each matching shortcut (all of
+                                        your own shortcuts by default), in
+                                        parallel. Output is printed in
+                                        shortcut order, each line prefixed
+                                        with the shortcut name.
+        -j, --jobs <n>                  with --each, the max number of
+                                        commands to run at once
+                                        (default 8)
+        --du [<pattern>]                print the disk usage of the target
+                                        dir of each matching shortcut (all
+                                        of your own shortcuts by default)
+        --sort size|name                with --du, sort by size (the
+                                        default, largest first) or name
+        --shorten                       copy stdin to stdout, rewriting
+                                        paths under shortcut targets to
+                                        the <shortcut>/<subpath> form
+        --warm [<pattern>]              read the top levels of the target
+                                        dirs of matching shortcuts (all by
+                                        default) to prime the filesystem
+                                        caches, e.g. from a login hook
+        --depth <n>                     with --warm, the number of levels
+                                        to read (default 2)
+        --timeout <secs>                with --warm, stop after this many
+                                        seconds (default 10); with --each,
+                                        kill a command that runs longer
+        --subscribe <url>               subscribe to the shortcut catalog
+                                        at the given URL
+        --unsubscribe                   drop the catalog subscription
+        --refresh-catalog               fetch catalog changes now
+        --update-suggestions            bring the index used to suggest
+                                        shortcuts up to date now (this is
+                                        otherwise done as needed)
+        --sync-export [<since>]         write shortcuts changed since the
+                                        given store version (default 0,
+                                        i.e. all) to stdout
+        --sync-apply <file>             merge changes from `--sync-export'
+                                        on another machine ('-' is stdin)
 
     Generally you have a set of directories that you commonly visit.
     Typing these paths in full can be a pain. This script allows one to
@@ -38,6 +135,89 @@
     As well, you can always use some standard shortcuts, such as '~'
     (home) and '...' (up two dirs).
 
+    Sub-path segments that do not exist are matched against the dirs at
+    that level as a glob or a unique prefix, e.g.:
+        go ko/*/tests       # the one "tests" dir one level under ko
+        go ko/s/c/u         # e.g. ko/src/chrome/util
+
+    Shortcuts can be kept in separate namespaces, e.g. for generated
+    per-project shortcuts. A "<ns>:<name>" shortcut is stored in its own
+    "shards/<ns>.xml" file next to your shortcuts file, and looking it up
+    only reads that file:
+        go -s work:ko ~/src/komodo
+        go work:ko/test
+
+    If a shortcut is (in) a git checkout, "<shortcut>@<branch>" is the
+    same place in the checkout (`git worktree') of the given branch:
+        go ko@feature-x/test
+
+    If a path is ambiguous, or `go --pick' is used, 'go' lets you pick
+    the dir in the terminal: type to filter the list, use the up and down
+    arrow keys to select and Enter to go there (Esc to cancel). Matches
+    are listed as they are found.
+
+    For an unknown shortcut, 'go' suggests similarly named ones. Set
+    GO_AUTOCORRECT=1 to have it go to the suggestion instead, if there is
+    just one.
+
+    Set GO_CDPATH to a list of search roots (separated like PATH) to
+    have 'go <name>' find <root>/<name> when <name> is not a shortcut.
+    The roots are tried in order.
+
+    Resolver plugins add computed shortcut schemes, e.g. "gh:org/repo"
+    or "bug:1234" (a namespace of the same name takes precedence). A
+    plugin for scheme <scheme> is either a module "<scheme>.py" in the
+    "plugins" dir next to your shortcuts file, or an entry point named
+    <scheme> in the "go.resolvers" group. Either way it provides a
+    "resolve(<rest>)" callable returning the dir for "<scheme>:<rest>".
+    A plugin is only imported when its scheme is used.
+
+    Pattern shortcuts map whole families of names to dirs. They are
+    <pattern> elements in the shortcuts file with a regular expression
+    for the name and a value that can refer to its groups, e.g.:
+        <pattern match="t(\\d+)" value="/work/tickets/\\1"/>
+        <pattern match="b(\\d+)" value="/builds/\\1"/>
+    so that 'go t1234' goes to "/work/tickets/1234". Only group
+    references (\\N and \\g<name>) are replaced in the value; other
+    backslashes, as in Windows paths, are kept. A pattern is only used
+    for a name that is not a shortcut; the first pattern matching (all
+    of) the name wins.
+
+    A shortcut can be computed when it is used, for targets that keep
+    moving:
+        go --rule newest -s nightly /builds/nightly   # newest subdir
+        go --rule greatest:build-* -s lastbuild /builds  # greatest
+                                        # subdir matching "build-*"
+        go --rule date -s today /var/log/app/%Y-%m-%d   # today's dir
+    A computed target is reused for a while (see --ttl) rather than
+    scanning the dir on every jump.
+
+    `go --du' remembers the size of the files in each dir it reads, so
+    the next run only reads the dirs that have changed (had files added,
+    removed or renamed) since. A file that grows in place is not noticed
+    until its dir changes.
+
+    A shortcut's value can refer to other shortcuts and to environment
+    variables, e.g. "{ko}/test" or "$BUILD_ROOT/x", so that related
+    shortcuts follow when a common root moves.
+
+    A team can share a catalog of shortcuts: a shortcuts.xml file served
+    over HTTP. When subscribed (see --subscribe), the catalog's shortcuts
+    are available under your own. The catalog is refreshed in the
+    background; 'go' never waits on the network.
+
+    To keep shortcuts in sync between machines, export the changes made
+    since the last sync on one and apply them on the other:
+        box1$ go --sync-export 42 > changes.xml
+        box2$ go --sync-apply changes.xml
+    Each shortcut is versioned, so concurrent edits merge the same way on
+    every machine (the latest edit wins) and deletions are kept (as
+    "tombstones") so that they sync too.
+
+    A shortcut can carry an environment profile that is applied to the
+    shell whenever you 'go' to it, e.g. to activate a virtualenv:
+        $ go --env ko source:/src/komodo/venv/bin/activate KOMODO_DEV=1
+
     See <http://code.google.com/p/go-tool/> for more information.
 """
 # Dev Notes:
@@ -55,9 +235,15 @@ from os.path import splitext, expanduser, join, exists
 import sys
 import getopt
 import re
+import itertools
+import contextlib
 import pprint
 import codecs
+import pickle
 import xml.dom.minidom
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping, ItemsView
 
 
 
@@ -66,6 +252,17 @@ import xml.dom.minidom
 class GoError(Exception):
     pass
 
+class AmbiguousPathError(GoError):
+    """A shortcut path matches more than one dir.
+
+    "candidates" is the list of matching dirs, best first.
+    """
+    def __init__(self, path, candidates):
+        GoError.__init__(self, "'%s' is ambiguous (%d matches)"
+                               % (path, len(candidates)))
+        self.path = path
+        self.candidates = candidates
+
 class InternalGoError(GoError):
     def __str__(self):
         return GoError.__str__(self) + """
@@ -83,6 +280,99 @@ class InternalGoError(GoError):
 
 _envvar = "GO_SHELL_SCRIPT"
 
+# Minimum number of seconds between background refreshes of a
+# subscribed shortcut catalog.
+_gCatalogRefreshInterval = 3600
+# Characters not allowed in a catalog's shortcut names and values: quotes
+# and control characters have no business in a path and only serve to
+# break out of the quoting in the generated shell script.
+_gUnsafeCatalogCharsRe = re.compile(r"[\"'`\x00-\x1f\x7f]")
+
+# References in shortcut values: "{<shortcut>}", "$VAR" or "${VAR}".
+_gReferenceRe = re.compile(r"\{([^{}/\\]+)\}|\$(\w+)|\$\{(\w+)\}")
+_gExpansions = None  # (<shortcuts>, <expansions>, <env used>)
+
+# Max number of candidate dirs kept at each level when matching sub-path
+# segments. See _matchSubpath().
+_gMaxSubpathCandidates = 100
+
+# Number of times to re-read and re-apply a change to the shortcuts file
+# if it changed underneath us. See _rewriteShortcutsXml().
+_gMaxWriteAttempts = 10
+
+# A valid shortcut namespace name: it names its shard file.
+_gNamespaceRe = re.compile(r"^\w[\w.-]+$")
+
+# Number of seconds a $GO_CDPATH search result (a hit or a miss) is
+# reused before the search roots are probed again. See _searchRoots().
+_gSearchRootHitTTL = 60
+_gSearchRootMissTTL = 10
+_gSearchRootResults = {}  # results already looked up in this process
+
+_gShardMaps = {}  # <namespace> -> (<stamp>, <ShortcutMap>) loaded so far
+
+# Limits for `go --find', see findPaths(). Dirs with these names are
+# never searched, in addition to those excluded by .gitignore files.
+_gFindMaxMatches = 20
+_gFindThreads = 8
+_gFindCacheSize = 64
+_gFindExcludes = [".git", ".hg", ".svn", "CVS", "__pycache__",
+                  "node_modules"]
+
+# The kinds of rules for computed shortcuts, and the default number of
+# seconds a computed target is reused. See _evalRule().
+_gRuleKinds = ("newest", "greatest", "date")
+_gRuleTTL = 60
+_gRules = None  # (<shortcuts>, <rules>), see _getRules()
+
+# The loaded pattern shortcuts, see _getPatternMatcher().
+_gPatternMatcher = None
+# Group references in a pattern shortcut's value: "\<N>" or "\g<name>".
+_gGroupRefRe = re.compile(r"\\(?:(\d{1,2})|g<(\w+)>)")
+
+# Max number of entries collected and shown by the picker, see
+# pickPath().
+_gMaxPickItems = 1000
+_gMaxPickLines = 10
+
+# Max number of shortcuts suggested for an unknown one, and the max edit
+# distance of a suggestion. See suggestShortcuts().
+_gMaxSuggestions = 5
+_gMaxSuggestionDistance = 2
+
+# Max number of new shortcut names to add to the suggestions index while
+# the user waits. More than that (e.g. on first use with a large catalog)
+# and the index is updated by a background process.
+_gMaxInlineSuggestionUpdates = 2000
+
+# Default max number of commands run at once by `go --each', see
+# runInShortcutDirs().
+_gEachJobs = 8
+
+# Max length of a line `go --shorten' holds on to while waiting for the
+# rest of it. Longer lines are processed in pieces. See shortenPaths().
+_gMaxShortenLine = 1024 * 1024
+
+# Max number of shortcut targets for which `go --shorten' compiles a regex
+# matching the targets directly. See _getShortenRegex().
+_gMaxShortenRegexTargets = 5000
+
+# Number of threads reading dirs for `go --du', see getDiskUsage().
+_gDiskUsageThreads = 8
+
+# Default budgets for `go --warm', see warmShortcuts().
+_gWarmDepth = 2
+_gWarmTimeout = 10.0
+_gWarmThreads = 8
+
+# Max number of entries in the persisted realpath cache.
+_gRealpathCacheSize = 256
+_gRealpaths = None  # the loaded realpath cache, see _realpath()
+
+# Environment variables that always differ after sourcing a script in a
+# subshell. These are not part of a script's environment delta.
+_gEnvDeltaIgnores = set(["_", "PWD", "OLDPWD", "SHLVL"])
+
 # On Windows, "console" or "windows" controls how some things behave.
 _subsystem = "console"
 if sys.platform.startswith("win") and\
@@ -101,15 +391,227 @@ set GO_SHELL_SCRIPT=""",
     "sh": """\
 # Bash shell driver for 'go' (http://code.google.com/p/go-tool/).
 function go {
-    export GO_SHELL_SCRIPT=$HOME/.__tmp_go.sh
-    python -m go $*
-    if [ -f $GO_SHELL_SCRIPT ] ; then
-        source $GO_SHELL_SCRIPT
+    export GO_SHELL_SCRIPT="$HOME/.__tmp_go.sh"
+    python -m go "$@"
+    if [ -f "$GO_SHELL_SCRIPT" ] ; then
+        source "$GO_SHELL_SCRIPT"
     fi
     unset GO_SHELL_SCRIPT
 }""",
 }
 
+# Shell snippets to show the `go --whereami' form of the current dir in
+# the prompt. The prompt is drawn for every command so the result is
+# cached per $PWD.
+_gPromptFuncFromShell = {
+    "sh": """\
+# Bash prompt helper for 'go' (http://code.google.com/p/go-tool/).
+# Use $GO_PROMPT in your prompt, e.g.: PS1='[$GO_PROMPT]\\$ '
+function _go_prompt_update {
+    if [ "$PWD" != "$_GO_PROMPT_PWD" ] ; then
+        GO_PROMPT=$(python -m go --whereami "$PWD" 2>/dev/null || echo "$PWD")
+        _GO_PROMPT_PWD=$PWD
+    fi
+}
+PROMPT_COMMAND="_go_prompt_update${PROMPT_COMMAND:+; $PROMPT_COMMAND}"
+""",
+}
+
+
+
+#---- shortcut storage
+
+class ShortcutMap(Mapping):
+    """A compact, read-only mapping of shortcut names to target dirs.
+
+    Generated shortcut catalogs can have hundreds of thousands of entries
+    whose targets share long prefixes (e.g. "/srv/builds/<project>/..."),
+    so rather than a dict of full strings:
+    - names are sorted and front-coded in blocks of _blockSize: the first
+      name of each block is kept as a string for binary search, the rest
+      as the length of the prefix shared with the previous name plus the
+      remaining suffix; and
+    - targets are nodes in a tree of path segments, so each distinct
+      segment and each shared dir prefix is stored once.
+    """
+    __slots__ = ("_heads", "_blocks", "_values", "_parents", "_segs",
+                 "_segOffsets", "_segData", "_memo")
+    _blockSize = 16
+    _memoSize = 4096 # number of looked up values to keep as strings
+
+    def __init__(self, items=()):
+        """Create a map from the given (<name>, <value>) pairs. A later
+        pair for the same name replaces an earlier one.
+        """
+        segIndexFromData = {}
+        nodeFromPath = {}
+        parents = array('I', [0])   # node 0 is the root
+        segs = array('I', [0])
+        segOffsets = array('I', [0])
+        segData = bytearray()
+
+        def nodeFromValue(value):
+            node = nodeFromPath.get(value)
+            if node is None:
+                head, sep, seg = value.rpartition(os.sep)
+                parent = sep and nodeFromValue(head) or 0
+                data = seg.encode("utf-8", "surrogatepass")
+                segIndex = segIndexFromData.get(data)
+                if segIndex is None:
+                    segIndex = segIndexFromData[data] = len(segOffsets) - 1
+                    segData.extend(data)
+                    segOffsets.append(len(segData))
+                node = nodeFromPath[value] = len(parents)
+                parents.append(parent)
+                segs.append(segIndex)
+            return node
+
+        nodeFromName = {}
+        for name, value in items:
+            nodeFromName[name] = nodeFromValue(value)
+        del segIndexFromData, nodeFromPath
+
+        names = sorted(nodeFromName)
+        self._values = array('I', [nodeFromName[n] for n in names])
+        del nodeFromName
+        self._heads = []
+        self._blocks = []
+        for i in range(0, len(names), self._blockSize):
+            self._heads.append(names[i])
+            prev = names[i].encode("utf-8", "surrogatepass")
+            block = bytearray()
+            for name in names[i+1:i+self._blockSize]:
+                curr = name.encode("utf-8", "surrogatepass")
+                shared = _commonPrefixLen(prev, curr, 255)
+                block.append(shared)
+                block += curr[shared:]
+                block.append(0)
+                prev = curr
+            self._blocks.append(bytes(block))
+        self._parents = parents
+        self._segs = segs
+        self._segOffsets = segOffsets
+        self._segData = bytes(segData)
+        self._memo = {}
+
+    def __getstate__(self):
+        return tuple(getattr(self, a) for a in self.__slots__[:-1])
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+        self._memo = {}
+
+    @classmethod
+    def _fromState(cls, state):
+        """Return a map from the given __getstate__() result.
+
+        The caches hold this plain state rather than a pickled map: the
+        class would be pickled as __main__.ShortcutMap when go.py is run
+        as a script and as go.ShortcutMap when imported, and neither can
+        load the other's.
+        """
+        self = cls.__new__(cls)
+        self.__setstate__(state)
+        return self
+
+    def __repr__(self):
+        return "<ShortcutMap: %d shortcuts>" % len(self)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, name):
+        return name in self._memo or self._indexOf(name) != -1
+
+    def __getitem__(self, name):
+        value = self._memo.get(name)
+        if value is not None:
+            return value
+        index = self._indexOf(name)
+        if index == -1:
+            raise KeyError(name)
+        value = self._valueFromNode(self._values[index])
+        if len(self._memo) < self._memoSize:
+            self._memo[name] = value
+        return value
+
+    def __iter__(self):
+        for i, head in enumerate(self._heads):
+            yield head
+            for curr in self._iterBlock(i):
+                yield curr.decode("utf-8", "surrogatepass")
+
+    def items(self):
+        return _ShortcutMapItemsView(self)
+
+    def _iterItems(self):
+        values = self._values
+        valueFromNode = self._valueFromNode
+        for i, name in enumerate(self):
+            yield name, valueFromNode(values[i])
+
+    def _iterBlock(self, i):
+        """Generate the (encoded) names in block i after its head."""
+        block = self._blocks[i]
+        prev = self._heads[i].encode("utf-8", "surrogatepass")
+        pos = 0
+        while pos < len(block):
+            end = block.index(0, pos+1)
+            prev = prev[:block[pos]] + block[pos+1:end]
+            yield prev
+            pos = end + 1
+
+    def _indexOf(self, name):
+        """Return the sorted index of the given name, or -1."""
+        i = bisect_right(self._heads, name) - 1
+        if i < 0:
+            return -1
+        index = i * self._blockSize
+        if self._heads[i] == name:
+            return index
+        try:
+            key = name.encode("utf-8", "surrogatepass")
+        except (AttributeError, UnicodeError):
+            return -1
+        for curr in self._iterBlock(i):
+            index += 1
+            if curr == key:
+                return index
+            elif curr > key: # UTF-8 sorts in code point order
+                return -1
+        return -1
+
+    def _valueFromNode(self, node):
+        parents, segs = self._parents, self._segs
+        segOffsets, segData = self._segOffsets, self._segData
+        parts = []
+        while node:
+            segIndex = segs[node]
+            parts.append(segData[segOffsets[segIndex]:segOffsets[segIndex+1]])
+            node = parents[node]
+        parts.reverse()
+        return os.sep.join(p.decode("utf-8", "surrogatepass") for p in parts)
+
+
+class _ShortcutMapItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping._iterItems()
+
+
+def _commonPrefixLen(a, b, limit):
+    """Return the length (at most "limit") of the common prefix of the
+    given sequences.
+    """
+    lo, hi = 0, min(len(a), len(b), limit)
+    while lo < hi: # invariant: a[:lo] == b[:lo]
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
 
 
 #---- public module interface
@@ -156,101 +658,862 @@ def getDefaultShortcuts():
     return shortcuts
 
 
-def setShortcut(name, value):
+def setShortcut(name, value, tags=None, group=None, rule=None):
     """Add the given shortcut mapping to the XML database.
 
         <shortcuts version="...">
-            <shortcut name="..." value="..."/>
+            <shortcut name="..." value="..." tags="..." group="..."
+                      rule="..." match="..." ttl="..."/>
         </shortcuts>
 
     A value of None deletes the named shortcut.
+    "tags" is an optional list of tags (e.g. "project:komodo") to set on
+        the shortcut, replacing existing tags. None (the default) leaves
+        the shortcut's tags alone.
+    "group" is an optional group name for the shortcut (used to organize
+        `go --list' output). None leaves the group alone and an empty
+        string removes it.
+    "rule" is an optional (<kind>, <glob>, <ttl>) tuple making this a
+        computed shortcut (see _evalRule()). <glob> and <ttl> may be
+        None. None leaves the rule alone and an empty tuple removes it.
+
+    The tag index (see getTagIndex()) is updated to match.
+
+    A "<ns>:<name>" shortcut is stored as <name> in the shard file for
+    namespace <ns> (created as needed). Namespaced shortcuts cannot have
+    tags or a group.
     """
-    shortcutsXml = getShortcutsFile()
-    if os.path.isfile(shortcutsXml):
-        dom = xml.dom.minidom.parse(shortcutsXml)
-    else:
-        dom = xml.dom.minidom.parseString(
-                    '<shortcuts version="1.0"></shortcuts>')
+    namespace, shortName = _splitNamespace(name)
+    if namespace is not None and (tags or group or rule):
+        raise GoError("namespaced shortcut '%s' cannot have tags, a group "
+                      "or a rule" % name)
+    if rule and rule[0] not in _gRuleKinds:
+        raise GoError("unknown rule '%s' (must be one of: %s)"
+                      % (rule[0], ", ".join(_gRuleKinds)))
 
-    shortcuts = dom.getElementsByTagName("shortcuts")[0]
-    for s in shortcuts.getElementsByTagName("shortcut"):
-        if s.getAttribute("name") == name:
+    def update(dom):
+        shortcuts = dom.getElementsByTagName("shortcuts")[0]
+        for s in shortcuts.getElementsByTagName("shortcut"):
+            if s.getAttribute("name") == shortName:
+                oldTags = s.getAttribute("tags").split()
+                oldGroup = s.getAttribute("group")
+                if value:
+                    s.setAttribute("value", value)
+                    _stampVersion(dom, s)
+                else:
+                    # Keep a tombstone so the deletion can be synced.
+                    tombstone = dom.createElement("deleted")
+                    tombstone.setAttribute("name", shortName)
+                    tombstone.setAttribute("mtime", s.getAttribute("mtime"))
+                    shortcuts.replaceChild(tombstone, s)
+                    _stampVersion(dom, tombstone)
+                break
+        else:
+            oldTags, oldGroup = [], ""
             if value:
+                s = dom.createElement("shortcut")
+                s.setAttribute("name", shortName)
                 s.setAttribute("value", value)
+                for tombstone in shortcuts.getElementsByTagName("deleted"):
+                    if tombstone.getAttribute("name") == shortName:
+                        s.setAttribute("mtime",
+                                       tombstone.getAttribute("mtime"))
+                        shortcuts.removeChild(tombstone)
+                shortcuts.appendChild(s)
+                _stampVersion(dom, s)
             else:
-                shortcuts.removeChild(s)
+                raise GoError("shortcut '%s' does not exist" % name)
+        newTags, newGroup = [], ""
+        if value:
+            if tags is not None:
+                if tags:
+                    s.setAttribute("tags", ' '.join(tags))
+                elif s.hasAttribute("tags"):
+                    s.removeAttribute("tags")
+            if group is not None:
+                if group:
+                    s.setAttribute("group", group)
+                elif s.hasAttribute("group"):
+                    s.removeAttribute("group")
+            if rule is not None:
+                for attr, attrValue in zip(("rule", "match", "ttl"),
+                                           rule or (None, None, None)):
+                    if isinstance(attrValue, float):
+                        attrValue = "%g" % attrValue
+                    if attrValue is not None:
+                        s.setAttribute(attr, str(attrValue))
+                    elif s.hasAttribute(attr):
+                        s.removeAttribute(attr)
+            newTags = s.getAttribute("tags").split()
+            newGroup = s.getAttribute("group")
+        return oldTags, oldGroup, newTags, newGroup
+
+    if namespace is not None:
+        shardXml = _getShardFile(namespace)
+        with _lockedStore(shardXml):
+            _rewriteShortcutsXml(update, shardXml)
+        return
+    with _lockedStore():
+        stamp = _getStoreStamp()
+        oldTags, oldGroup, newTags, newGroup = _rewriteShortcutsXml(update)
+        _updateTagIndex(stamp, name, oldTags, oldGroup, newTags, newGroup)
+
+
+def getShortcutTags(name):
+    """Return the (<tags>, <group>) of the named shortcut.
+
+    <tags> is a list of tag strings and <group> is the group name or
+    None.
+    """
+    index = getTagIndex()
+    tags = [t for t, names in index["tags"].items() if name in names]
+    for group, names in index["groups"].items():
+        if name in names:
             break
     else:
-        if value:
-            s = dom.createElement("shortcut")
-            s.setAttribute("name", name)
-            s.setAttribute("value", value)
-            shortcuts.appendChild(s)
+        group = None
+    return sorted(tags), group
+
+
+def getTagIndex():
+    """Return the tag and group index of the shortcuts.
+
+    This is a dict with:
+        "tags"      mapping each tag to the set of shortcut names with it
+        "groups"    mapping each group name to the set of its shortcuts
+
+    The index is maintained when shortcuts are changed with
+    setShortcut() and saved in the cache dir. It is only rebuilt from
+    scratch if the shortcuts file (or catalog) was changed otherwise.
+    """
+    stamp = _getStoreStamp()
+    cached = _readCache("tagindex")
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    index = _buildTagIndex()
+    _writeCache("tagindex", (stamp, index))
+    return index
+
+
+def getShortcuts(namespace=None):
+    """Return the shortcut dictionary.
+
+    "namespace" is an optional namespace name. If given, only the
+        shortcuts in that namespace's shard file are returned (by their
+        names within the namespace). Raises a GoError if there is no
+        such namespace.
+
+    If subscribed to a shortcut catalog (see setCatalogUrl()) the locally
+    cached catalog shortcuts are included, under the user's own
+    shortcuts. A stale catalog is refreshed by a background process.
+
+    The returned dictionary is a read-only ShortcutMap. Building it for a
+    large store is relatively expensive, so it is cached (in the cache
+    dir) until the shortcuts file or catalog changes.
+    """
+    if namespace is not None:
+        shardXml = _getShardFile(namespace)
+        stamp = _getStoreStamp(namespace)
+        if stamp[0] is None:
+            raise GoError("no such namespace: '%s'" % namespace)
+        memo = _gShardMaps.get(namespace)
+        if memo is not None and memo[0] == stamp:
+            return memo[1]
+        cached = _readCache("shortcutmap." + namespace)
+        if cached is not None and cached[0] == stamp:
+            shortcuts = ShortcutMap._fromState(cached[1])
+        else:
+            elems = _iterShortcutsXml(shardXml)
+            next(elems) # skip the root
+            shortcuts = ShortcutMap((e.get("name"), e.get("value", ""))
+                                    for e in elems if e.tag == "shortcut")
+            _writeCache("shortcutmap." + namespace,
+                        (stamp, shortcuts.__getstate__()))
+        _gShardMaps[namespace] = (stamp, shortcuts)
+        return shortcuts
+
+    items = sorted(getDefaultShortcuts().items())
+    stamp = (_getStoreStamp(), items)
+    cached = _readCache("shortcutmap")
+    if cached is not None and cached[0] == stamp:
+        catalogUrl, state = cached[1:]
+        shortcuts = ShortcutMap._fromState(state)
+        if catalogUrl:
+            _checkCatalogAge()
+        return shortcuts
+
+    catalogUrl = None
+    userItems = []
+    shortcutsXml = getShortcutsFile()
+    if os.path.isfile(shortcutsXml):
+        elems = _iterShortcutsXml(shortcutsXml)
+        catalogUrl = next(elems).get("catalog")
+        if catalogUrl:
+            # A new list: "items" is also part of the cache stamp.
+            items = items + list(_getCatalogShortcuts(catalogUrl).items())
+            _checkCatalogAge()
+        userItems = ((e.get("name"), e.get("value", "")) for e in elems
+                     if e.tag == "shortcut")
+
+    shortcuts = ShortcutMap(itertools.chain(items, userItems))
+    _writeCache("shortcutmap",
+                (stamp, catalogUrl, shortcuts.__getstate__()))
+    return shortcuts
+
+
+def getNamespaces():
+    """Return the sorted list of shortcut namespace names."""
+    shardsDir = os.path.dirname(_getShardFile("x"))
+    try:
+        fnames = os.listdir(shardsDir)
+    except EnvironmentError:
+        return []
+    return sorted(fname[:-4] for fname in fnames
+                  if fname.endswith(".xml")
+                  and _gNamespaceRe.match(fname[:-4]))
+
+
+def canonicalPath(path):
+    """Return the canonical form of the given dir path.
+
+    This is the absolute, normalized path as the user sees it. For
+    example, if $HOME is "/home/trentm" but that is a symlink to
+    "/usr/home/trentm", then "/usr/home/trentm/src" is canonically
+    "/home/trentm/src". Shortcut targets are stored and compared in this
+    form.
+    """
+    path = os.path.normpath(os.path.abspath(path))
+    for logical, physical in _getLogicalRoots():
+        if path == physical or path.startswith(physical + os.sep):
+            return logical + path[len(physical):]
+    return path
+
+
+def getShortcutEnv(name):
+    """Return the environment profile for the named shortcut.
+
+    Environment profiles are stored as children of the shortcut element:
+
+        <shortcut name="..." value="...">
+            <env name="FOO" value="bar"/>       <!-- set FOO -->
+            <env name="BAZ"/>                   <!-- unset BAZ -->
+            <path name="PATH" value="..."/>     <!-- prepend to PATH -->
+            <source value="..."/>               <!-- source a script -->
+        </shortcut>
+
+    The returned profile is a list of (<kind>, <name>, <value>) tuples in
+    document order, where <kind> is one of "env", "path" or "source".
+    <name> is None for "source" and <value> is None for an unset "env".
+    An unknown shortcut has an empty profile.
+
+    The profiles of all shortcuts are read in one pass over the shortcuts
+    file and cached, so that this is cheap for every `cd'.
+    """
+    stamp = _getStoreStamp()
+    cached = _readCache("envprofiles")
+    if cached is None or cached[0] != stamp:
+        profiles = {}
+        shortcutsXml = getShortcutsFile()
+        if os.path.isfile(shortcutsXml):
+            elems = _iterShortcutsXml(shortcutsXml)
+            next(elems) # skip the root
+            for elem in elems:
+                if elem.tag != "shortcut" or not len(elem):
+                    continue
+                profile = profiles[elem.get("name")] = []
+                for node in elem:
+                    if node.tag == "env":
+                        profile.append(("env", node.get("name"),
+                                        node.get("value")))
+                    elif node.tag == "path":
+                        profile.append(("path", node.get("name") or "PATH",
+                                        node.get("value", "")))
+                    elif node.tag == "source":
+                        profile.append(("source", None,
+                                        node.get("value", "")))
+        cached = (stamp, profiles)
+        _writeCache("envprofiles", cached)
+    return list(cached[1].get(name, []))
+
+
+def setShortcutEnv(name, profile):
+    """Set the environment profile for the named shortcut.
+
+    "profile" is a list of (<kind>, <name>, <value>) tuples as returned
+        by getShortcutEnv(). An empty list clears the profile.
+
+    Raises a GoError if the shortcut does not exist.
+    """
+    def update(dom):
+        shortcuts = dom.getElementsByTagName("shortcuts")[0]
+        for s in shortcuts.getElementsByTagName("shortcut"):
+            if s.getAttribute("name") == name:
+                break
         else:
             raise GoError("shortcut '%s' does not exist" % name)
 
-    if not os.path.isdir(os.path.dirname(shortcutsXml)):
-        os.makedirs(os.path.dirname(shortcutsXml))
-    fout = open(shortcutsXml, 'w')
-    fout.write(dom.toxml())
-    fout.close()
+        for node in list(s.childNodes):
+            s.removeChild(node)
+        for kind, varName, value in profile:
+            node = dom.createElement(kind)
+            if varName is not None:
+                node.setAttribute("name", varName)
+            if value is not None:
+                node.setAttribute("value", value)
+            s.appendChild(node)
+        _stampVersion(dom, s)
 
+    with _lockedStore():
+        _rewriteShortcutsXml(update)
 
-def getShortcuts():
-    """Return the shortcut dictionary."""
-    shortcuts = getDefaultShortcuts()
 
+def exportChanges(since=0):
+    """Return the shortcuts changed since the given store version as a
+    shortcuts XML document (a string).
+
+    Each change made to the store bumps its version (the "seq" attribute
+    of the root element) and records it on the changed shortcut. The
+    returned document has the current store version as its "seq", to
+    use as "since" for the next export to the same machine. Deleted
+    shortcuts are included as <deleted> tombstones.
+
+    With "since" 0 the whole store is exported, including shortcuts
+    written before versioning was added (which have no "seq").
+    """
     shortcutsXml = getShortcutsFile()
     if os.path.isfile(shortcutsXml):
         dom = xml.dom.minidom.parse(shortcutsXml)
+    else:
+        dom = xml.dom.minidom.parseString(
+                    '<shortcuts version="1.0"></shortcuts>')
+    shortcuts = dom.documentElement
+    export = xml.dom.minidom.parseString(
+                    '<shortcuts version="1.0"></shortcuts>')
+    export.documentElement.setAttribute("seq",
+                                        shortcuts.getAttribute("seq") or "0")
+    for node in shortcuts.childNodes:
+        if node.nodeType == node.ELEMENT_NODE \
+           and node.tagName in ("shortcut", "deleted") \
+           and (not since or int(node.getAttribute("seq") or 0) > since):
+            export.documentElement.appendChild(export.importNode(node, True))
+    return export.toxml()
+
+
+def applyChanges(content):
+    """Merge the changes exported with exportChanges() on another store.
+
+    "content" is the exported XML document (a string or bytes).
+
+    For each shortcut (or tombstone) the version with the latest "mtime"
+    wins, with ties broken by "origin" (the host that made the change)
+    and then by content. So applying changes in any order on any store
+    gives the same result. Returns (<number of changes applied>,
+    <new store version>).
+    """
+    try:
+        changes = xml.dom.minidom.parseString(content).documentElement
+    except Exception as ex:
+        raise GoError("invalid sync data: %s" % ex)
+
+    def update(dom):
+        shortcuts = dom.documentElement
+        localFromName = {}
+        for node in shortcuts.childNodes:
+            if node.nodeType == node.ELEMENT_NODE \
+               and node.tagName in ("shortcut", "deleted"):
+                localFromName[node.getAttribute("name")] = node
+        numApplied = 0
+        for change in changes.childNodes:
+            if change.nodeType != change.ELEMENT_NODE \
+               or change.tagName not in ("shortcut", "deleted"):
+                continue
+            local = localFromName.get(change.getAttribute("name"))
+            if local is not None \
+               and _versionKey(local) >= _versionKey(change):
+                continue
+            node = dom.importNode(change, True)
+            if local is None:
+                shortcuts.appendChild(node)
+            else:
+                shortcuts.replaceChild(node, local)
+            localFromName[node.getAttribute("name")] = node
+            seq = int(shortcuts.getAttribute("seq") or 0) + 1
+            shortcuts.setAttribute("seq", str(seq))
+            node.setAttribute("seq", str(seq))
+            numApplied += 1
+        return numApplied, int(shortcuts.getAttribute("seq") or 0)
+
+    with _lockedStore():
+        return _rewriteShortcutsXml(update)
+
+
+def getSourceDelta(script):
+    """Return the environment changes made by sourcing the given script.
+
+    Sourcing a script (e.g. a virtualenv's "bin/activate") is slow, so
+    the delta is cached keyed on the script's mtime and size. The delta
+    is a list of (<op>, <name>, <value>) tuples where <op> is one of:
+        "set"       set <name> to <value>
+        "prepend"   prepend <value> to the current value of <name>
+        "unset"     unset <name> (<value> is None)
+    """
+    st = os.stat(script)
+    stamp = (st.st_mtime, st.st_size)
+    deltas = _readCache("envdeltas") or {}
+    try:
+        cachedStamp, delta = deltas[script]
+    except KeyError:
+        pass
+    else:
+        if cachedStamp == stamp:
+            return delta
+
+    delta = _computeSourceDelta(script)
+    deltas[script] = (stamp, delta)
+    _writeCache("envdeltas", deltas)
+    return delta
+
+
+def getCatalogUrl():
+    """Return the URL of the subscribed shortcut catalog, or None."""
+    shortcutsXml = getShortcutsFile()
+    if not os.path.isfile(shortcutsXml):
+        return None
+    return next(_iterShortcutsXml(shortcutsXml)).get("catalog") or None
+
+
+def setCatalogUrl(url):
+    """Subscribe to the shortcut catalog at the given URL.
+
+    A catalog is a shortcuts.xml file served over HTTP. A url of None
+    drops the subscription.
+    """
+    def update(dom):
+        shortcuts = dom.getElementsByTagName("shortcuts")[0]
+        if url:
+            shortcuts.setAttribute("catalog", url)
+        elif shortcuts.hasAttribute("catalog"):
+            shortcuts.removeAttribute("catalog")
+
+    with _lockedStore():
+        _rewriteShortcutsXml(update)
+
+
+def refreshCatalog(url=None, timeout=10):
+    """Fetch the shortcut catalog and update the local cached copy.
+
+    "url" is the catalog URL. It defaults to the subscribed catalog.
+    "timeout" is the network timeout in seconds.
+
+    A conditional GET (using the ETag and Last-Modified of the cached
+    copy) is used so an unchanged catalog is not downloaded again.
+    Returns True if the cached catalog changed. Raises a GoError if the
+    catalog could not be fetched or parsed, or if a shortcut name or
+    value has quotes or control characters in it.
+    """
+    import urllib.request
+    import urllib.error
+    if url is None:
+        url = getCatalogUrl()
+        if url is None:
+            raise GoError("not subscribed to a shortcut catalog")
+
+    cached = _readCache("catalog")
+    if cached is None or cached["url"] != url:
+        cached = {"url": url, "etag": None, "modified": None,
+                  "shortcuts": {}}
+    request = urllib.request.Request(url, headers={
+        "User-Agent": "go/%s" % __version__})
+    if cached["etag"]:
+        request.add_header("If-None-Match", cached["etag"])
+    if cached["modified"]:
+        request.add_header("If-Modified-Since", cached["modified"])
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+        try:
+            content = response.read()
+            headers = response.headers
+        finally:
+            response.close()
+    except urllib.error.HTTPError as ex:
+        if ex.code != 304:
+            raise GoError("could not fetch catalog '%s': %s" % (url, ex))
+        # Not modified. Touch the cache to reset the refresh interval.
+        try:
+            os.utime(join(_getCacheDir(), "catalog.pickle"), None)
+        except EnvironmentError:
+            pass
+        return False
+    except (urllib.error.URLError, EnvironmentError) as ex:
+        raise GoError("could not fetch catalog '%s': %s" % (url, ex))
+
+    try:
+        dom = xml.dom.minidom.parseString(content)
         shortcutsNode = dom.getElementsByTagName("shortcuts")[0]
-        for shortcutNode in shortcutsNode.getElementsByTagName("shortcut"):
-            name = shortcutNode.getAttribute("name")
-            value = shortcutNode.getAttribute("value")
-            shortcuts[name] = value
+    except Exception as ex:
+        raise GoError("invalid catalog '%s': %s" % (url, ex))
+    shortcuts = {}
+    attrs = {}
+    for shortcutNode in shortcutsNode.getElementsByTagName("shortcut"):
+        name = shortcutNode.getAttribute("name")
+        value = shortcutNode.getAttribute("value")
+        if _gUnsafeCatalogCharsRe.search(name + value):
+            raise GoError("invalid catalog '%s': shortcut '%s' has quotes "
+                          "or control characters in it" % (url, name))
+        shortcuts[name] = value
+        tags = shortcutNode.getAttribute("tags").split()
+        group = shortcutNode.getAttribute("group")
+        if tags or group:
+            attrs[name] = (tags, group)
 
-    return shortcuts
+    changed = shortcuts != cached["shortcuts"] \
+              or attrs != cached.get("attrs", {})
+    cached.update(etag=headers.get("ETag"),
+                  modified=headers.get("Last-Modified"),
+                  shortcuts=shortcuts, attrs=attrs)
+    _writeCache("catalog", cached)
+    return changed
 
 
-def resolvePath(path):
+def resolvePath(path, shortcuts=None, namespace=None):
     """Return a dir for the given <shortcut>[/<subpath>].
 
-    Raises a GoError if the shortcut does not exist.
+    "shortcuts" is an optional shortcut dictionary as returned by
+        getShortcuts(). Pass it in when resolving many paths to avoid
+        reloading the shortcuts file for each one.
+    "namespace" is the namespace of "shortcuts", if any.
+
+    A "<ns>:<shortcut>[/<subpath>]" path is resolved against just the
+    shortcuts of namespace <ns>, if there is such a namespace. A
+    "<shortcut>@<branch>[/<subpath>]" path is resolved in the git worktree
+    for <branch> (see _resolveWorktree()).
+
+    If the sub-path doesn't exist, its segments that don't exist are
+    matched as globs or unique prefixes of the dirs at that level (see
+    _matchSubpath()).
+
+    Raises a GoError if the shortcut does not exist and an
+    AmbiguousPathError if the sub-path matches more than one dir.
     """
-    shortcuts = getShortcuts()
+    if namespace is None:
+        ns, rest = _splitNamespace(path)
+        if ns is not None and os.path.isfile(_getShardFile(ns)):
+            try:
+                return resolvePath(rest, getShortcuts(ns), ns)
+            except KeyError:
+                raise KeyError(_splitShortcutPath(path)[0])
+    if shortcuts is None:
+        shortcuts = getShortcuts()
 
     if path:
-        tagend = path.find('/')
-        if tagend == -1:
-            tagend = path.find('\\')
-        if tagend == -1:
-            tag, suffix = path, None
-        else:
-            tag, suffix = path[:tagend], path[tagend+1:]
+        tag, suffix = _splitShortcutPath(path)
         try:
-            target = shortcuts[tag]
+            target = shortcuts.get(tag)
+            if target is None:
+                # A pattern shortcut? Raises a KeyError if not.
+                target = _expandPatternShortcut(tag, namespace)
+            else:
+                expanded = _getExpansions(shortcuts, namespace).get(tag)
+                if isinstance(expanded, GoError):
+                    raise expanded
+                elif expanded is not None:
+                    target = expanded
+                rule = namespace is None and _getRules(shortcuts).get(tag)
+                if rule:
+                    target = _evalRule(tag, target, *rule)
         except KeyError:
+            # A computed "<scheme>:..." path from a resolver plugin?
+            scheme, colon, rest = path.partition(':')
+            resolver = colon and len(scheme) > 1 \
+                       and _getSchemeResolver(scheme)
+            if resolver:
+                target = resolver(rest)
+                if not target:
+                    raise GoError("'%s' resolver could not resolve '%s'"
+                                  % (scheme, path))
+                return target
+
             # Bash will expand ~ (used as a shortcut) into the user's
             # actual home directory. We still want to support '~' as a
             # shortcut in Bash so try to determine if it is likely that
             # the user typed it and act accordingly.
             home = os.path.expanduser('~')
-            if path.startswith(home):
+            name, at, branchPath = path.partition('@')
+            if os.path.isabs(path):
+                path = canonicalPath(path)
+            if at and name in shortcuts:
+                target, suffix = _resolveWorktree(
+                    resolvePath(name, shortcuts, namespace), branchPath)
+            elif path.startswith(home):
                 tag, suffix = '~', path[len(home)+1:]
                 target = shortcuts[tag]
             elif os.path.isdir(path):
                 target = ""
                 suffix = path
+            elif not os.path.isabs(tag) and _searchRoots(tag):
+                target = _searchRoots(tag)
             else:
                 raise
         if suffix:
-            target = os.path.join(target, os.path.normpath(suffix))
+            literal = os.path.join(target, os.path.normpath(suffix))
+            if target and not os.path.exists(literal):
+                matches = _matchSubpath(target, suffix)
+                if len(matches) > 1:
+                    raise AmbiguousPathError(path, matches)
+                target = matches and matches[0] or literal
+            else:
+                target = literal
     else:
         raise GoError("no path was given")
 
     return target
 
 
+def whereami(path=None):
+    """Return the given path in <shortcut>[/<subpath>] form.
+
+    "path" is the path to shorten. It defaults to the current directory.
+
+    The shortcut whose target is the longest prefix of the path is used.
+    If several shortcuts have that target the shortest name wins.
+    Returns None if no shortcut target is a prefix of the path.
+
+    The lookup uses a trie of path components that is built from
+    getShortcuts() and saved in the cache dir alongside the shortcuts
+    file, so this is cheap enough to call for every shell prompt.
+    """
+    if path is None:
+        path = os.getcwd()
+    path = canonicalPath(path)
+    node = _getTargetTrie()
+    parts = _pathParts(path)
+    name, depth = node.get(None), 0
+    for i, part in enumerate(parts):
+        node = node.get(part)
+        if node is None:
+            break
+        if None in node:
+            name, depth = node[None], i+1
+    if name is None:
+        return None
+    rest = [p for p in os.path.abspath(path).split(os.sep) if p][depth:]
+    return '/'.join([name] + rest)
+
+
+def shortenPaths(fin, fout):
+    """Copy "fin" to "fout" (binary files), rewriting each path under a
+    shortcut target to its <shortcut>/<subpath> form, as whereami() does.
+
+    Only whole paths are rewritten: a target must start at the beginning
+    of a path (e.g. after whitespace, a quote or a ':') and be followed
+    by a path separator or the end of the path. The longest matching
+    target wins.
+
+    All targets are matched in one pass by a single regular expression
+    built from a (byte-wise) trie of the targets, see _getShortenRegex().
+    Input is processed as it arrives, a line at a time at most, and
+    "fout" is flushed after each piece so that this works in a
+    `tail -f' pipeline.
+    """
+    regex, repl = _getShortenRegex()
+    if regex is None:
+        sub = lambda data: data
+    else:
+        sub = lambda data: regex.sub(repl, data)
+    read = getattr(fin, "read1", fin.read)
+    pending = b""
+    while True:
+        chunk = read(65536)
+        if not chunk:
+            break
+        chunk = pending + chunk
+        end = chunk.rfind(b"\n") + 1
+        if not end:
+            if len(chunk) < _gMaxShortenLine:
+                pending = chunk
+                continue
+            end = len(chunk)
+        pending = chunk[end:]
+        fout.write(sub(chunk[:end]))
+        fout.flush()
+    if pending:
+        fout.write(sub(pending))
+    fout.flush()
+
+
+def pickPath(sources):
+    """Let the user interactively pick a path in the terminal and return
+    it, or None if the user cancelled.
+
+    "sources" is a list of callables, each returning an iterator of
+        (<label>, <path>) candidates. The sources are run in threads and
+        their candidates are listed as they arrive, earlier sources'
+        first, so a slow source (e.g. one reading the filesystem) does
+        not hold up a fast one.
+
+    The user types to filter the list (each word must be in the label or
+    path), selects with the arrow keys (or Ctrl+P/Ctrl+N), picks with
+    Enter and cancels with Esc or Ctrl+C. Raises a GoError if there is no
+    terminal to use.
+    """
+    import threading
+    import queue
+    import select
+    try:
+        import termios
+        import tty
+        term = open("/dev/tty", "r+b", buffering=0)
+    except (ImportError, EnvironmentError):
+        raise GoError("cannot pick a path without a terminal")
+    fd = term.fileno()
+
+    stop = threading.Event()
+    arrivals = queue.Queue()
+    def run(index, source):
+        try:
+            for label, path in source():
+                if stop.is_set():
+                    break
+                arrivals.put((index, label, path))
+        except (EnvironmentError, GoError):
+            pass
+        finally:
+            arrivals.put(None)
+    for index, source in enumerate(sources):
+        thread = threading.Thread(target=run, args=(index, source))
+        thread.daemon = True
+        thread.start()
+    numRunning = len(sources)
+
+    candidates = [] # (<source index>, <arrival order>, <label>, <path>)
+    seen = set()
+    query = ""
+    selected = 0
+    numLinesDrawn = 0
+    def draw(shown):
+        try:
+            width = os.get_terminal_size(fd).columns or 80
+        except EnvironmentError:
+            width = 80
+        width = max(20, width - 1)
+        status = numRunning and " (searching...)" or ""
+        lines = ["> %s%s   [%d/%d]" % (query, status, len(shown),
+                                      len(candidates))]
+        for i, (label, path) in enumerate(shown[:_gMaxPickLines]):
+            line = label and "%-20s  %s" % (label, path) or path
+            line = "  " + line[:width-2]
+            if i == selected:
+                line = "\x1b[7m%s\x1b[0m" % line
+            lines.append(line)
+        out = numLinesDrawn and "\r\x1b[%dA" % numLinesDrawn or "\r"
+        out += "\x1b[J" + "\n".join(lines)
+        term.write(out.encode("utf-8", "replace"))
+        return len(lines) - 1
+
+    oldAttrs = termios.tcgetattr(fd)
+    picked = None
+    try:
+        tty.setcbreak(fd)
+        dirty = True
+        while True:
+            while True:
+                try:
+                    arrival = arrivals.get_nowait()
+                except queue.Empty:
+                    break
+                dirty = True
+                if arrival is None:
+                    numRunning -= 1
+                elif arrival[2] not in seen \
+                     and len(candidates) < _gMaxPickItems:
+                    seen.add(arrival[2])
+                    candidates.append((arrival[0], len(candidates))
+                                      + arrival[1:])
+            if dirty:
+                words = query.lower().split()
+                shown = [(c[2], c[3]) for c in sorted(candidates)
+                         if all(w in c[2].lower() or w in c[3].lower()
+                                for w in words)]
+                selected = max(0, min(selected, len(shown) - 1))
+                numLinesDrawn = draw(shown)
+                dirty = False
+
+            if not select.select([fd], [], [], 0.05)[0]:
+                continue
+            key = os.read(fd, 32)
+            dirty = True
+            if key in (b"\r", b"\n"):
+                if shown:
+                    picked = shown[selected][1]
+                break
+            elif key in (b"\x1b", b"\x03", b"\x07"):
+                break
+            elif key in (b"\x1b[A", b"\x1bOA", b"\x10"):
+                selected = max(0, selected - 1)
+            elif key in (b"\x1b[B", b"\x1bOB", b"\x0e"):
+                selected = min(selected + 1, _gMaxPickLines - 1)
+            elif key in (b"\x7f", b"\x08"):
+                query = query[:-1]
+                selected = 0
+            elif not key.startswith(b"\x1b"):
+                text = key.decode("utf-8", "ignore")
+                query += "".join(ch for ch in text if ch.isprintable())
+                selected = 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        up = numLinesDrawn and "\x1b[%dA" % numLinesDrawn or ""
+        term.write(("\r" + up + "\x1b[J").encode("ascii"))
+        termios.tcsetattr(fd, termios.TCSADRAIN, oldAttrs)
+        term.close()
+    return picked
+
+
+def suggestShortcuts(name, shortcuts=None):
+    """Return the names of the shortcuts most similar to the given
+    (unknown) one, closest first. At most _gMaxSuggestions names within
+    an edit distance of _gMaxSuggestionDistance (less for short names)
+    are returned.
+
+    "shortcuts" is an optional shortcut dictionary to suggest from. It
+        defaults to the user's shortcuts (as returned by getShortcuts()).
+
+    The names are looked up in a BK-tree of the shortcut names, so the
+    cost of a lookup does not grow linearly with the number of
+    shortcuts. The tree for the user's shortcuts is saved in the cache
+    dir and updated (rather than rebuilt) when shortcuts are added. The
+    tree for a given "shortcuts" dictionary is built for this call only.
+    """
+    maxDistance = min(_gMaxSuggestionDistance, max(1, len(name) // 3))
+    if shortcuts is None:
+        shortcuts = getShortcuts()
+        words, children = _getSuggestionTree(shortcuts)
+    else:
+        words, children = [], []
+        _addSuggestionWords(words, children, shortcuts)
+    if not words:
+        return []
+
+    masks, length = _charMasks(name), len(name)
+    found = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        dist = _editDistance(masks, length, words[node])
+        if dist <= maxDistance and words[node] in shortcuts:
+            found.append((dist, words[node]))
+        kids = children[node]
+        if kids:
+            # Only subtrees that can hold words within maxDistance of the
+            # name (by the triangle inequality).
+            for childDist, child in kids.items():
+                if dist - maxDistance <= childDist <= dist + maxDistance:
+                    stack.append(child)
+    found.sort()
+    return [word for dist, word in found[:_gMaxSuggestions]]
+
+
 def generateShellScript(scriptName, path=None):
     """Generate a shell script with the given name to change to the
     given shortcut path.
@@ -263,74 +1526,520 @@ def generateShellScript(scriptName, path=None):
     if path is None:
         target = None
     else:
-        target = resolvePath(path)
+        target = resolvePath(path, shortcuts)
+    profile = []
+    if target:
+        tag = _splitShortcutPath(path)[0]
+        if tag in shortcuts:
+            profile = getShortcutEnv(tag)
 
     if sys.platform.startswith("win"):
         fbat = open(scriptName, 'w')
         fbat.write('@echo off\n')
         if target:
+            # cmd.exe has no escape for a '"' within quotes (and paths
+            # cannot have one anyway).
+            if re.search(r'["\x00-\x1f]', target):
+                raise GoError("cannot change to '%s': it has quotes or "
+                              "control characters in it" % target)
             drive, tail = os.path.splitdrive(target)
             fbat.write('@echo off\n')
             if drive:
                 fbat.write('call %s\n' % drive)
             fbat.write('call cd "%s"\n' % target)
             fbat.write('title "%s"\n' % target)
+        for kind, name, value in profile:
+            if kind == "env":
+                fbat.write('set %s=%s\n' % (name, value or ""))
+            elif kind == "path":
+                fbat.write('set %s=%s;%%%s%%\n' % (name, value, name))
+            elif kind == "source":
+                fbat.write('call "%s"\n' % value)
         fbat.close()
     else:
+        from shlex import quote
+        def prepend(name, value):
+            # Dirs already on the list are skipped, else every jump
+            # (or cached "source" delta) would grow it again.
+            for dir in reversed([d for d in value.split(os.pathsep) if d]):
+                fsh.write('case ":$%s:" in *%s*) ;; '
+                          '*) export %s=%s"${%s:+:$%s}" ;; esac\n'
+                          % (name, quote(":%s:" % dir), name, quote(dir),
+                             name, name))
         fsh = open(scriptName, 'w')
         fsh.write('#!/bin/sh\n')
         if target:
-            fsh.write('cd "%s"\n' % target)
+            fsh.write('cd %s\n' % quote(target))
+        for kind, name, value in profile:
+            if kind == "env" and value is None:
+                fsh.write('unset %s\n' % name)
+            elif kind == "env":
+                fsh.write('export %s=%s\n' % (name, quote(value)))
+            elif kind == "path":
+                prepend(name, value)
+            elif kind == "source":
+                try:
+                    delta = getSourceDelta(value)
+                except (EnvironmentError, GoError) as ex:
+                    fsh.write('echo %s >&2\n'
+                              % quote("go: warning: could not source "
+                                      "'%s': %s" % (value, ex)))
+                    continue
+                for op, name, value in delta:
+                    if op == "unset":
+                        fsh.write('unset %s\n' % name)
+                    elif op == "set":
+                        fsh.write('export %s=%s\n' % (name, quote(value)))
+                    elif op == "prepend":
+                        prepend(name, value)
         fsh.close()
 
 
-def printShortcuts(shortcuts, subheader=None):
-    # Organize the shortcuts into groups.
-    defaults = [re.escape(s) for s in getDefaultShortcuts().keys()]
-    groupMap = { # mapping of group regex to group order and title
-        "^(%s)$" % '|'.join(defaults): (0, "Default shortcuts"),
-        None: (1, "Custom shortcuts"),
-    }
-    grouped = {
-        # <group title>: [<member shortcuts>...]
-    }
-    for shortcut in shortcuts:
-        for pattern, (order, title) in groupMap.items():
-            if pattern and re.search(pattern, shortcut):
-                if title in grouped:
-                    grouped[title].append(shortcut)
-                else:
-                    grouped[title] = [shortcut]
-                break
-        else:
-            title = "Custom shortcuts"
-            if title in grouped:
-                grouped[title].append(shortcut)
-            else:
-                grouped[title] = [shortcut]
-    for memberList in grouped.values(): memberList.sort()
-    groups = []
-    titles = list(groupMap.values())
-    titles.sort()
+def resolvePaths(fin, fout, sep='\n'):
+    """Resolve each shortcut path read from "fin" and write the absolute
+    result to "fout".
 
-    # Construct the table.
-    table = ""
-    header = "Go Shortcuts"
-    if subheader:
-        header += ": " + subheader
-    table += ' '*20 + header + '\n'
-    table += ' '*20 + '='*len(header) + '\n'
-    for order, title in titles:
-        if title not in grouped: continue
-        table += '\n' + title + ":\n"
-        for shortcut in grouped[title]:
-            dir = shortcuts[shortcut]
-            #TODO: Might want to prettily shorten long names.
-            #if len(dir) > 53:
-            #    dir = dir[:50] + "..."
-            table += "  %-20s  %s\n" % (shortcut, dir)
+    "fin" and "fout" are binary file objects.
+    "sep" is the record separator for both input and output: '\n'
+        (the default) or '\0'.
 
-    # Display the table.
+    The shortcuts file is loaded once. A record that cannot be resolved
+    results in a "go: error: ..." record in its place so that output
+    records stay aligned with input records. The results for the records
+    of each read from "fin" are written and flushed before reading more,
+    so a caller can wait for the answer to each path it writes. Returns
+    the number of records that could not be resolved.
+    """
+    shortcuts = getShortcuts()
+    bsep = sep.encode("ascii")
+    fsdecode, fsencode = os.fsdecode, os.fsencode
+    abspath = os.path.abspath
+    numErrors = 0
+    for records in _iterRecordBatches(fin, bsep):
+        out = []
+        for record in records:
+            path = fsdecode(record)
+            if sep == '\n' and path.endswith('\r'):
+                path = path[:-1]
+            try:
+                result = fsencode(abspath(resolvePath(path, shortcuts)))
+            except KeyError as ex:
+                numErrors += 1
+                result = ("go: error: Unrecognized shortcut: %s"
+                          % ex).encode("utf-8", "replace")
+            except GoError as ex:
+                numErrors += 1
+                result = ("go: error: %s" % ex).encode("utf-8", "replace")
+            out.append(result)
+        fout.write(bsep.join(out) + bsep)
+        fout.flush()
+    return numErrors
+
+
+def findPaths(root, pattern, maxMatches=None):
+    """Return the paths under the given dir whose names match the given
+    glob (or plain name), shallowest first.
+
+    "maxMatches" is the number of matches after which to stop looking
+        (default _gFindMaxMatches).
+
+    Files and dirs excluded by .gitignore files (and the _gFindExcludes
+    dirs) are skipped. Dirs are read level by level by a pool of
+    threads. The result is cached per root and pattern, and reused as
+    long as none of the dirs (or .gitignore files) that were read has
+    changed since.
+    """
+    from fnmatch import fnmatch
+    from concurrent.futures import ThreadPoolExecutor
+    if maxMatches is None:
+        maxMatches = _gFindMaxMatches
+    root = os.path.abspath(root)
+
+    def getMtime(dir):
+        try:
+            return os.stat(dir).st_mtime
+        except EnvironmentError:
+            return None
+
+    def scan(dir, rules):
+        """Return (<mtimes>, <matches>, <subdirs>, <rules for subdirs>)
+        for the given dir, or None if it cannot be read. <mtimes> are
+        those of the dir and its .gitignore file.
+        """
+        try:
+            mtimes = {dir: os.stat(dir).st_mtime}
+            with os.scandir(dir) as it:
+                entries = list(it)
+        except EnvironmentError:
+            return None
+        for entry in entries:
+            if entry.name == ".gitignore":
+                mtimes[entry.path] = getMtime(entry.path)
+                rules = rules + _readIgnoreRules(dir)
+        matches, subdirs = [], []
+        for entry in entries:
+            try:
+                # Don't follow symlinks, to avoid cycles.
+                isDir = entry.is_dir(follow_symlinks=False)
+            except EnvironmentError:
+                continue
+            if _isIgnored(rules, entry.path, entry.name, isDir):
+                continue
+            if fnmatch(entry.name, pattern):
+                matches.append(entry.path)
+            if isDir:
+                subdirs.append(entry.path)
+        return mtimes, sorted(matches), sorted(subdirs), rules
+
+    key = (root, pattern, maxMatches)
+    cache = _readCache("find") or {}
+    executor = ThreadPoolExecutor(_gFindThreads)
+    try:
+        if key in cache:
+            matches, visited = cache[key]
+            dirs = list(visited)
+            if list(executor.map(getMtime, dirs)) \
+               == [visited[d] for d in dirs]:
+                return matches
+
+        matches = []
+        visited = {}
+        level = [(root, [(root, x, True) for x in _gFindExcludes])]
+        while level and len(matches) < maxMatches:
+            nextLevel = []
+            results = executor.map(lambda a: scan(*a), level)
+            for (dir, rules), result in zip(level, results):
+                if result is None:
+                    continue
+                mtimes, found, subdirs, subRules = result
+                visited.update(mtimes)
+                matches += found
+                if len(matches) >= maxMatches:
+                    break
+                nextLevel += [(d, subRules) for d in subdirs]
+            results.close() # cancel the scans that are not needed
+            level = nextLevel
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    matches = matches[:maxMatches]
+
+    cache.pop(key, None)
+    cache[key] = (matches, visited)
+    while len(cache) > _gFindCacheSize:
+        del cache[next(iter(cache))] # the oldest
+    _writeCache("find", cache)
+    return matches
+
+
+def runInShortcutDirs(command, pattern=None, jobs=None, timeout=None):
+    """Run a command in the target dir of each matching shortcut.
+
+    "command" is the command's argument list.
+    "pattern" is an optional string: only the shortcuts whose names
+        contain it (case-insensitively) are used. The default shortcuts
+        (e.g. '~') are never used.
+    "jobs" is the max number of commands to run at once (default
+        _gEachJobs).
+    "timeout" is the optional number of seconds after which a command is
+        killed.
+
+    Generates (<name>, <dir>, <exit code>, <output>) for each shortcut in
+    name order, as soon as its command (and those of all shortcuts
+    before it) is done. <exit code> is None if the command timed out.
+    <output> is the command's combined stdout and stderr (bytes). A dir
+    that is the target of several shortcuts is only used once.
+    """
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+    if jobs is None:
+        jobs = _gEachJobs
+    elif jobs < 1:
+        raise GoError("invalid number of jobs: %s (must be at least 1)"
+                      % jobs)
+    shortcuts = getShortcuts()
+    defaults = getDefaultShortcuts()
+    targets = []
+    seen = set()
+    for name in sorted(shortcuts):
+        if pattern and pattern.lower() not in name.lower():
+            continue
+        if name in defaults and shortcuts[name] == defaults[name]:
+            continue
+        try:
+            target = resolvePath(name, shortcuts)
+        except (KeyError, GoError):
+            continue
+        if os.path.isabs(target) and target not in seen \
+           and os.path.isdir(target):
+            seen.add(target)
+            targets.append((name, target))
+
+    def run(target):
+        try:
+            p = subprocess.run(command, cwd=target[1],
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, timeout=timeout)
+            return p.returncode, p.stdout
+        except subprocess.TimeoutExpired as ex:
+            return None, ex.output or b""
+        except EnvironmentError as ex:
+            return 127, ("go: %s\n" % ex).encode("utf-8", "replace")
+
+    with ThreadPoolExecutor(jobs) as executor:
+        for target, result in zip(targets, executor.map(run, targets)):
+            yield target + result
+
+
+def getDiskUsage(pattern=None):
+    """Return the disk usage of the target dir of each matching shortcut
+    as a list of (<name>, <dir>, <bytes>) in name order, and the total
+    (not counting a dir under several of the targets twice). As with
+    du, a file with several hard links is only counted once.
+
+    "pattern" is an optional string: only the shortcuts whose names
+        contain it (case-insensitively) are used. The default shortcuts
+        (e.g. '~') are never used.
+
+    The dir trees are read level by level by a pool of threads. For each
+    dir the total size of its files and its list of subdirs are saved in
+    the cache dir, keyed by the dir's mtime, so that unchanged dirs are
+    only stat'd (not read) next time. A dir that is the target of several
+    shortcuts is only used once and symlinks are not followed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    shortcuts = getShortcuts()
+    defaults = getDefaultShortcuts()
+    targets = []
+    seen = set()
+    for name in sorted(shortcuts):
+        if pattern and pattern.lower() not in name.lower():
+            continue
+        if name in defaults and shortcuts[name] == defaults[name]:
+            continue
+        try:
+            target = resolvePath(name, shortcuts)
+        except (KeyError, GoError):
+            continue
+        if os.path.isabs(target) and os.path.isdir(target):
+            target = os.path.normpath(target)
+            if target not in seen:
+                seen.add(target)
+                targets.append((name, target))
+
+    # <dir> -> (<mtime>, <bytes>, <subdirs>, <hard linked files>)
+    cache = _readCache("du") or {}
+    def getBytes(st):
+        # Count allocated blocks, like du, if known.
+        blocks = getattr(st, "st_blocks", None)
+        return blocks is None and st.st_size or blocks * 512
+
+    def measure(dir):
+        """Return the (<mtime>, <bytes>, <subdirs>, <hard linked files>)
+        of the given dir. <bytes> includes the dir itself but not its
+        subdirs or the files with several hard links, which are listed
+        as ((<device>, <inode>), <bytes>) so they can be counted once.
+        """
+        try:
+            st = os.stat(dir)
+        except EnvironmentError:
+            return None
+        cached = cache.get(dir)
+        if cached is not None and cached[0] == st.st_mtime:
+            return cached
+        size = getBytes(st)
+        subdirs = []
+        linked = []
+        try:
+            with os.scandir(dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        else:
+                            est = entry.stat(follow_symlinks=False)
+                            if est.st_nlink > 1:
+                                linked.append(((est.st_dev, est.st_ino),
+                                               getBytes(est)))
+                            else:
+                                size += getBytes(est)
+                    except EnvironmentError:
+                        pass
+        except EnvironmentError:
+            pass
+        return (st.st_mtime, size, subdirs, linked)
+
+    totals = [0] * len(targets)
+    linkedSeen = [set() for t in targets]
+    total = 0
+    totalDirs = set()
+    totalLinkedSeen = set()
+    measured = {}
+    level = [(i, target) for i, (name, target) in enumerate(targets)]
+    executor = ThreadPoolExecutor(_gDiskUsageThreads)
+    try:
+        while level:
+            # A dir under several targets is only measured once.
+            dirs = sorted(set(dir for i, dir in level if dir not in measured))
+            measured.update(zip(dirs, executor.map(measure, dirs)))
+            nextLevel = []
+            for i, dir in level:
+                result = measured[dir]
+                if result is None:
+                    continue
+                totals[i] += result[1]
+                if dir not in totalDirs:
+                    totalDirs.add(dir)
+                    total += result[1]
+                for key, size in result[3]:
+                    if key not in linkedSeen[i]:
+                        linkedSeen[i].add(key)
+                        totals[i] += size
+                    if key not in totalLinkedSeen:
+                        totalLinkedSeen.add(key)
+                        total += size
+                nextLevel += [(i, subdir) for subdir in result[2]]
+            level = nextLevel
+    finally:
+        executor.shutdown()
+    measured = dict((d, m) for d, m in measured.items() if m is not None)
+
+    # Keep what is known about dirs not under the measured targets, and
+    # drop dirs under them that no longer exist.
+    prefixes = tuple(set(t + os.sep for n, t in targets))
+    for dir, info in cache.items():
+        if dir not in seen and not dir.startswith(prefixes):
+            measured.setdefault(dir, info)
+    _writeCache("du", measured)
+    return ([(name, target, size)
+             for (name, target), size in zip(targets, totals)], total)
+
+
+def warmShortcuts(pattern=None, depth=None, timeout=None):
+    """Read the top levels of shortcut target dirs so that the OS caches
+    their metadata, making the next `cd' (and `ls', etc.) into them fast.
+
+    "pattern" is an optional string: only the shortcuts whose names
+        contain it (case-insensitively) are warmed. The default shortcuts
+        (e.g. '~') are never warmed.
+    "depth" is the number of levels to read under each target (default
+        _gWarmDepth). 1 reads just the target dirs.
+    "timeout" is the number of seconds after which no more dirs are read
+        (default _gWarmTimeout).
+
+    Dirs are read (with os.scandir() and a stat of each entry) by a small
+    pool of threads, so as not to overload a file server. Returns the
+    (<number of dirs read>, <number of entries stat'd>).
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    if depth is None:
+        depth = _gWarmDepth
+    if timeout is None:
+        timeout = _gWarmTimeout
+    deadline = time.time() + timeout
+
+    shortcuts = getShortcuts()
+    defaults = getDefaultShortcuts()
+    targets = set()
+    for name in shortcuts:
+        if pattern and pattern.lower() not in name.lower():
+            continue
+        if name in defaults and shortcuts[name] == defaults[name]:
+            continue
+        try:
+            target = resolvePath(name, shortcuts)
+        except (KeyError, GoError):
+            continue
+        if os.path.isabs(target):
+            targets.add(target)
+
+    def scan(dir):
+        """Return (<subdirs>, <number of entries>) of the given dir, or
+        None if out of time.
+        """
+        if time.time() > deadline:
+            return None
+        subdirs = []
+        numEntries = 0
+        try:
+            with os.scandir(dir) as it:
+                for entry in it:
+                    try:
+                        entry.stat(follow_symlinks=False)
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                    except EnvironmentError:
+                        pass
+                    numEntries += 1
+        except EnvironmentError:
+            pass
+        return subdirs, numEntries
+
+    numDirs = numEntries = 0
+    level = sorted(targets)
+    executor = ThreadPoolExecutor(_gWarmThreads)
+    try:
+        for i in range(depth):
+            nextLevel = []
+            for result in executor.map(scan, level):
+                if result is not None:
+                    nextLevel += result[0]
+                    numEntries += result[1]
+                    numDirs += 1
+            if time.time() > deadline:
+                break
+            level = nextLevel
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return numDirs, numEntries
+
+
+def printShortcuts(shortcuts, subheader=None):
+    # Organize the shortcuts into groups: the default shortcuts, then
+    # user-defined groups (from the tag index) and the rest.
+    defaults = getDefaultShortcuts()
+    groupFromName = {}
+    for group, names in getTagIndex()["groups"].items():
+        for name in names:
+            groupFromName[name] = group
+    grouped = {
+        # <group title>: [<member shortcuts>...]
+    }
+    titles = set()
+    for shortcut in shortcuts:
+        if shortcut in defaults:
+            order, title = 0, "Default shortcuts"
+        elif shortcut in groupFromName:
+            order, title = 1, groupFromName[shortcut]
+        else:
+            order, title = 2, "Custom shortcuts"
+        if title in grouped:
+            grouped[title].append(shortcut)
+        else:
+            grouped[title] = [shortcut]
+            titles.add((order, title))
+    for memberList in grouped.values(): memberList.sort()
+    titles = sorted(titles)
+
+    # Construct the table.
+    table = ""
+    header = "Go Shortcuts"
+    if subheader:
+        header += ": " + subheader
+    table += ' '*20 + header + '\n'
+    table += ' '*20 + '='*len(header) + '\n'
+    for order, title in titles:
+        if title not in grouped: continue
+        table += '\n' + title + ":\n"
+        for shortcut in grouped[title]:
+            dir = shortcuts[shortcut]
+            #TODO: Might want to prettily shorten long names.
+            #if len(dir) > 53:
+            #    dir = dir[:50] + "..."
+            table += "  %-20s  %s\n" % (shortcut, dir)
+
+    # Display the table.
     if _subsystem == "windows":
         import win32ui
         import win32con
@@ -578,6 +2287,1494 @@ def _indent(s, width=4, skip_first_line=False):
         return indentstr + indentstr.join(lines)
 
 
+def _tagsAndGroup(name, tagArgs, group):
+    """Return the (<tags>, <group>) arguments to setShortcut() for the
+    given -t|--tag option arguments, which add (or, with a leading '-',
+    remove) tags from the named shortcut's current tags.
+    """
+    if not tagArgs:
+        return None, group
+    tags = getShortcutTags(name)[0]
+    for tag in tagArgs:
+        if tag.startswith('-'):
+            if tag[1:] in tags:
+                tags.remove(tag[1:])
+        elif tag not in tags:
+            tags.append(tag)
+    return tags, group
+
+
+def _splitNamespace(name):
+    """Split a "<ns>:<rest>" name into (<ns>, <rest>), or return
+    (None, <name>) if it has no namespace.
+
+    One-letter prefixes are not namespaces: they are Windows drives.
+    """
+    ns, colon, rest = name.partition(':')
+    if colon and _gNamespaceRe.match(ns):
+        return ns, rest
+    return None, name
+
+
+def _getShardFile(namespace):
+    """Return the path to the shard file for the given namespace."""
+    return join(os.path.dirname(getShortcutsFile()), "shards",
+                namespace + ".xml")
+
+
+def _splitShortcutPath(path):
+    """Split a <shortcut>[/<subpath>] into (<shortcut>, <subpath>).
+
+    <subpath> is None if there is none.
+    """
+    tagend = path.find('/')
+    if tagend == -1:
+        tagend = path.find('\\')
+    if tagend == -1:
+        return path, None
+    else:
+        return path[:tagend], path[tagend+1:]
+
+
+def _matchSubpath(root, subpath):
+    """Return the list of dirs under "root" matching "subpath".
+
+    Each segment of the sub-path is matched against the dirs at that
+    level: a segment that exists (dir or not) is used as is and never
+    abbreviated, else a segment with glob chars is matched as a glob,
+    else as a prefix (case-insensitively if there is no case-sensitive
+    match at that level). Each level is listed with a single os.scandir()
+    and candidates without a match are dropped right away, so the full
+    tree is never walked.
+
+    The returned dirs are ranked by depth and then most recently
+    modified first.
+    """
+    from fnmatch import fnmatchcase
+    candidates = [(root, 0)]
+    segments = [s for s in re.split(r"[/\\]+", os.path.normpath(subpath))
+                if s and s != '.']
+    for seg in segments:
+        if seg == os.pardir:
+            candidates = [(os.path.dirname(c), m) for c, m in candidates]
+            continue
+        isGlob = [ch for ch in "*?[" if ch in seg]
+        lowerSeg = seg.lower()
+        nextCandidates, caseCandidates = [], []
+        for dir, mtime in candidates:
+            exact, matches, caseMatches = None, [], []
+            try:
+                entries = list(os.scandir(dir))
+            except EnvironmentError:
+                continue
+            for entry in entries:
+                name = entry.name
+                if name == seg:
+                    exact = entry
+                    break
+                try:
+                    if not entry.is_dir():
+                        continue
+                except EnvironmentError:
+                    continue
+                if isGlob:
+                    if fnmatchcase(name, seg):
+                        matches.append(entry)
+                elif name.startswith(seg):
+                    matches.append(entry)
+                elif name.lower().startswith(lowerSeg):
+                    caseMatches.append(entry)
+            if exact is not None:
+                matches, caseMatches = [exact], []
+            for entries, found in ((matches, nextCandidates),
+                                   (caseMatches, caseCandidates)):
+                for entry in entries:
+                    try:
+                        mtime = entry.stat().st_mtime
+                    except EnvironmentError:
+                        mtime = 0
+                    found.append((entry.path, mtime))
+        candidates = (nextCandidates or caseCandidates)[
+                        :_gMaxSubpathCandidates]
+        if not candidates:
+            break
+    candidates.sort(key=lambda c: (c[0].count(os.sep), -c[1]))
+    return [c for c, m in candidates]
+
+
+def _readIgnoreRules(dir):
+    """Return the exclude rules in the given dir's .gitignore file as a
+    list of (<base dir>, <glob>, <dirs only>) tuples.
+
+    Negated ("!...") patterns are not supported and are ignored.
+    """
+    rules = []
+    try:
+        f = open(join(dir, ".gitignore"), encoding="utf-8",
+                 errors="replace")
+    except EnvironmentError:
+        return rules
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(('#', '!')):
+                continue
+            dirOnly = line.endswith('/')
+            line = line.rstrip('/')
+            if line:
+                rules.append((dir, line, dirOnly))
+    finally:
+        f.close()
+    return rules
+
+
+def _isIgnored(rules, path, name, isDir):
+    """Return True iff the given file or dir is excluded by one of the
+    given rules (see _readIgnoreRules()).
+
+    As with .gitignore, a glob without a '/' matches the name at any
+    depth and one with a '/' matches the path relative to its base dir.
+    """
+    from fnmatch import fnmatchcase
+    for base, glob, dirOnly in rules:
+        if dirOnly and not isDir:
+            continue
+        if '/' in glob:
+            relPath = path[len(base)+1:].replace(os.sep, '/')
+            if fnmatchcase(relPath, glob.lstrip('/')):
+                return True
+        elif fnmatchcase(name, glob):
+            return True
+    return False
+
+
+def _parseEnvSetting(setting):
+    """Parse a `go --env' <setting> into a (<kind>, <name>, <value>)
+    environment profile tuple.
+    """
+    if setting.startswith("source:"):
+        return ("source", None, os.path.abspath(setting[len("source:"):]))
+    elif setting.startswith("-"):
+        kind, name, value = "env", setting[1:], None
+    elif "=" in setting:
+        name, value = setting.split("=", 1)
+        if name.endswith("+"):
+            kind, name = "path", name[:-1]
+        else:
+            kind = "env"
+    else:
+        raise GoError("invalid environment setting: '%s'" % setting)
+    if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+        raise GoError("invalid environment variable name: '%s'" % name)
+    return (kind, name, value)
+
+
+def _computeSourceDelta(script):
+    """Source "script" in a subshell and return the changes it makes to
+    the environment. See getSourceDelta().
+    """
+    import subprocess
+    import shutil
+    shell = shutil.which("bash") or "/bin/sh"
+    before = dict(os.environ)
+    before.pop(_envvar, None)
+    dumper = "import os,sys,marshal; marshal.dump(dict(os.environ), " \
+             "sys.stdout.buffer)"
+    cmd = '. "$1" >/dev/null 2>&1 </dev/null && exec "$2" -c "$3"'
+    p = subprocess.Popen([shell, "-c", cmd, "sh", script, sys.executable,
+                          dumper],
+                         stdout=subprocess.PIPE, env=before)
+    output = p.communicate()[0]
+    if p.returncode:
+        raise GoError("sourcing '%s' failed (exit status %s)"
+                      % (script, p.returncode))
+    import marshal
+    after = marshal.loads(output)
+
+    delta = []
+    for name in sorted(after):
+        if name in _gEnvDeltaIgnores:
+            continue
+        old, new = before.get(name), after[name]
+        if old == new:
+            continue
+        elif old and new.endswith(os.pathsep + old):
+            delta.append(("prepend", name, new[:-len(old)]))
+        else:
+            delta.append(("set", name, new))
+    for name in sorted(before):
+        if name not in after and name not in _gEnvDeltaIgnores:
+            delta.append(("unset", name, None))
+    return delta
+
+
+def _pathParts(path):
+    """Return the normalized list of components of the given path for
+    comparing paths, e.g. "/usr/Lib/" -> ["usr", "lib"] on Windows.
+    """
+    return [p for p in _normpath(os.path.abspath(path)).split(os.sep) if p]
+
+
+def _getTargetTrie():
+    """Return a trie, keyed by path component, of shortcut targets.
+
+    Each node is a dict mapping a path component to a child node. A node
+    for a shortcut target maps None to the preferred shortcut name.
+
+    Computed shortcuts (see _evalRule()) are left out: their value is
+    only the base dir that their target is computed from.
+    """
+    stamp = (_getStoreStamp(), _getLogicalRoots())
+    cached = _readCache("whereami")
+    if cached is not None and cached[0] == stamp and _isSameEnv(cached[1]):
+        return cached[2]
+
+    trie = {}
+    shortcuts = getShortcuts()
+    expansions = _getExpansions(shortcuts)
+    rules = _getRules(shortcuts)
+    for name, value in shortcuts.items():
+        if name in rules:
+            continue
+        value = expansions.get(name, value)
+        if not isinstance(value, str) or not os.path.isabs(value):
+            continue # relative defaults like '..'
+        node = trie
+        for part in _pathParts(canonicalPath(value)):
+            node = node.setdefault(part, {})
+        current = node.get(None)
+        if current is None or (len(name), name) < (len(current), current):
+            node[None] = name
+    envUsed = _gExpansions[2]
+    _writeCache("whereami", (stamp, envUsed, trie))
+    return trie
+
+
+def _getShortenRegex():
+    """Return the (<regex>, <repl>) for shortenPaths(), i.e. to
+    `<regex>.sub(<repl>, <bytes>)'. <regex> is None if there are no
+    shortcut targets.
+
+    The targets and preferred names come from the whereami() trie. With
+    up to _gMaxShortenRegexTargets targets <regex> matches the targets
+    themselves. With more, compiling that gets slow (about 40us per
+    target) so <regex> matches whole paths starting with the first
+    component of a target and <repl> looks up their longest target
+    prefix. The regex source is cached and rebuilt whenever the trie is.
+    """
+    trie = _getTargetTrie()
+    stamp = _getFileStamp(join(_getCacheDir(), "whereami.pickle"))
+    cached = _readCache("shorten")
+    if stamp is not None and cached is not None and cached[0] == stamp:
+        source, byPrefix, names = cached[1:]
+    else:
+        names = {}
+        stack = [(trie, [])]
+        while stack:
+            node, parts = stack.pop()
+            if None in node and parts:
+                target = os.sep.join(parts)
+                if not os.path.splitdrive(target)[0]:
+                    target = os.sep + target
+                names[os.fsencode(target)] = node[None].encode(
+                    "utf-8", "surrogateescape")
+            for part, child in node.items():
+                if part is not None:
+                    stack.append((child, parts + [part]))
+
+        sep = os.fsencode(os.sep)
+        byPrefix = len(names) > _gMaxShortenRegexTargets
+        if byPrefix:
+            keys = set(t[:t.find(sep, 1)] if t.find(sep, 1) > 0 else t
+                       for t in names)
+        else:
+            keys = names
+        byteTrie = {}
+        for key in keys:
+            node = byteTrie
+            for byte in key:
+                node = node.setdefault(byte, {})
+            node[None] = True
+        # A path starts after a delimiter (or at the start of the text)
+        # and a target must be followed by a separator or a delimiter.
+        # The start check is put after the first byte so the regex
+        # engine can quickly skip to candidate positions.
+        delims = br"""\s"'`:;,=|<>()\[\]{}"""
+        alternatives = [re.escape(bytes([byte])) + br"(?<![^%s].)" % delims
+                        + _trieRegexSource(byteTrie[byte])
+                        for byte in sorted(byteTrie)]
+        source = names and (br"(?:%s)(?![^%s%s])%s"
+                            % (b"|".join(alternatives), re.escape(sep),
+                               delims, byPrefix and b"[^%s]*" % delims
+                               or b"")) or None
+        _writeCache("shorten", (stamp, source, byPrefix, names))
+
+    if not source:
+        return None, None
+    caseless = sys.platform.startswith("win")
+    if byPrefix:
+        sep = os.fsencode(os.sep)
+        get = names.get
+        def repl(match):
+            path = match.group(0)
+            key = caseless and path.lower() or path
+            end = len(key)
+            while end > 0:
+                name = get(key[:end])
+                if name is not None:
+                    return name + path[end:]
+                end = key.rfind(sep, 0, end)
+            return path
+    elif caseless:
+        def repl(match):
+            return names[match.group(0).lower()]
+    else:
+        def repl(match):
+            return names[match.group(0)]
+    return re.compile(source, caseless and re.I or 0), repl
+
+
+def _trieRegexSource(trie):
+    """Return regex source (bytes) matching the byte strings in the given
+    trie (as built by _getShortenRegex()), longest first.
+
+    Runs of single-child nodes are collapsed into one literal, so the
+    recursion depth is only the number of branching nodes in a target.
+    """
+    alternatives = []
+    for byte in sorted(k for k in trie if k is not None):
+        literal = bytes([byte])
+        node = trie[byte]
+        while len(node) == 1 and None not in node:
+            (byte, node), = node.items()
+            literal += bytes([byte])
+        alternatives.append(re.escape(literal) + _trieRegexSource(node))
+    if not alternatives:
+        return b""
+    elif len(alternatives) == 1:
+        source = alternatives[0]
+    else:
+        source = b"(?:" + b"|".join(alternatives) + b")"
+    if None in trie:
+        # Greedy, so the longer targets are tried first.
+        source = b"(?:" + source + b")?"
+    return source
+
+
+def _iterShortcutsXml(path):
+    """Generate the elements of the given shortcuts XML file.
+
+    The root <shortcuts> element is yielded first (with its attributes
+    but without children) and then each of its child elements as it is
+    parsed. Children are discarded once yielded so that memory use does
+    not grow with the size of the file.
+    """
+    from xml.etree.ElementTree import iterparse
+    root = None
+    depth = 0
+    for event, elem in iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = elem
+                yield root
+        else:
+            depth -= 1
+            if depth == 1:
+                yield elem
+                del root[:]
+
+
+def _getCatalogShortcuts(url):
+    """Return the cached shortcuts for the given catalog URL.
+
+    This never touches the network. If there is no cached copy a
+    background process is started to fetch it.
+    """
+    cached = _readCache("catalog")
+    if cached is None or cached["url"] != url:
+        cached = {"url": url, "etag": None, "modified": None,
+                  "shortcuts": {}}
+        _writeCache("catalog", cached)
+        _startInBackground("--refresh-catalog")
+    return cached["shortcuts"]
+
+
+def _checkCatalogAge():
+    """Start a background refresh of the cached shortcut catalog if it is
+    older than _gCatalogRefreshInterval.
+    """
+    import time
+    path = join(_getCacheDir(), "catalog.pickle")
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except EnvironmentError:
+        return
+    if age > _gCatalogRefreshInterval:
+        # Touch the cache so that only one refresh is started.
+        try:
+            os.utime(path, None)
+        except EnvironmentError:
+            pass
+        _startInBackground("--refresh-catalog")
+
+
+def _startInBackground(option):
+    """Run `go <option>' in a detached background process."""
+    import subprocess
+    env = dict(os.environ)
+    env.pop(_envvar, None)
+    kwargs = {}
+    if sys.platform.startswith("win"):
+        kwargs["creationflags"] = 0x00000008 # DETACHED_PROCESS
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                          option],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, env=env, **kwargs)
+    except EnvironmentError:
+        pass
+
+
+def _getExpansions(shortcuts, namespace=None):
+    """Return a dict of the expanded values of those shortcuts whose
+    values have references (see _gReferenceRe).
+
+    "namespace" is the namespace of "shortcuts", if any.
+
+    An expansion that fails (a reference to an unknown shortcut, or a
+    reference cycle) is a GoError instance instead of a string. An
+    unset environment variable is left as is.
+
+    The table is computed once per version of the shortcuts (and of the
+    referenced environment variables) and cached, so references cost
+    nothing per lookup.
+    """
+    global _gExpansions
+    if _gExpansions is not None and _gExpansions[0] is shortcuts:
+        return _gExpansions[1]
+
+    storeStamp = _getStoreStamp(namespace)
+    cacheName = "expansions"
+    if namespace is not None:
+        cacheName += "." + namespace
+    cached = _readCache(cacheName)
+    if cached is not None and cached[0] == storeStamp \
+       and _isSameEnv(cached[1]):
+        envUsed, expansions = cached[1:]
+        expansions = dict((n, isinstance(v, tuple) and GoError(v[0]) or v)
+                          for n, v in expansions.items())
+    else:
+        envUsed = {}
+        expansions = {}
+        def expand(name, stack):
+            if name in expansions:
+                return expansions[name]
+            if name in stack:
+                raise GoError("shortcut reference cycle: %s"
+                              % " -> ".join(stack + [name]))
+            stack = stack + [name]
+            def repl(match):
+                ref, var = match.group(1), match.group(2) or match.group(3)
+                if ref is not None:
+                    if ref not in shortcuts:
+                        raise GoError("shortcut '%s' refers to unknown "
+                                      "shortcut '%s'" % (name, ref))
+                    value = expand(ref, stack)
+                    if isinstance(value, GoError):
+                        raise value
+                    return value
+                envUsed[var] = os.environ.get(var)
+                if envUsed[var] is None:
+                    return match.group(0)
+                return envUsed[var]
+            value = shortcuts[name]
+            if '{' in value or '$' in value:
+                try:
+                    value = _gReferenceRe.sub(repl, value)
+                except GoError as ex:
+                    value = ex
+                expansions[name] = value
+            return value
+        for name, value in shortcuts.items():
+            if '{' in value or '$' in value:
+                expand(name, [])
+        # Drop values without actual references (e.g. a literal '$').
+        expansions = dict((n, v) for n, v in expansions.items()
+                          if v != shortcuts[n])
+        # Failures are cached as (<message>,): an unpickled GoError would
+        # be of go.GoError when run as a script (__main__.GoError) or vice
+        # versa.
+        _writeCache(cacheName, (storeStamp, envUsed,
+            dict((n, isinstance(v, GoError) and (str(v),) or v)
+                 for n, v in expansions.items())))
+
+    _gExpansions = (shortcuts, expansions, envUsed)
+    return expansions
+
+
+def _isSameEnv(env):
+    """Return True iff the given environment variables (a dict mapping
+    name to value, or None if unset) still have the same values.
+    """
+    for name, value in env.items():
+        if os.environ.get(name) != value:
+            return False
+    return True
+
+
+def _buildTagIndex():
+    """Build the tag index (see getTagIndex()) from the shortcuts file and
+    the cached catalog.
+    """
+    attrsFromName = {}
+    shortcutsXml = getShortcutsFile()
+    if os.path.isfile(shortcutsXml):
+        elems = _iterShortcutsXml(shortcutsXml)
+        if next(elems).get("catalog"):
+            cached = _readCache("catalog") or {}
+            attrsFromName.update(cached.get("attrs", {}))
+        for elem in elems:
+            if elem.tag == "shortcut":
+                attrsFromName[elem.get("name")] = (
+                    elem.get("tags", "").split(), elem.get("group", ""))
+    index = {"tags": {}, "groups": {}}
+    for name, (tags, group) in attrsFromName.items():
+        for tag in tags:
+            index["tags"].setdefault(tag, set()).add(name)
+        if group:
+            index["groups"].setdefault(group, set()).add(name)
+    return index
+
+
+def _updateTagIndex(oldStamp, name, oldTags, oldGroup, newTags, newGroup):
+    """Update the saved tag index for a change to the named shortcut.
+
+    "oldStamp" is the store stamp from before the change. If the saved
+    index does not match it, it is out of date anyway and is left to be
+    rebuilt.
+    """
+    cached = _readCache("tagindex")
+    if cached is None or cached[0] != oldStamp:
+        return
+    index = cached[1]
+    catalog = _readCache("catalog")
+    if catalog and name in catalog.get("attrs", {}):
+        # The change may (un)hide tags of a catalog shortcut.
+        return
+    for key, old, new in (("tags", oldTags, newTags),
+                          ("groups", oldGroup and [oldGroup] or [],
+                                     newGroup and [newGroup] or [])):
+        for item in old:
+            names = index[key].get(item)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del index[key][item]
+        for item in new:
+            index[key].setdefault(item, set()).add(name)
+    _writeCache("tagindex", (_getStoreStamp(), index))
+
+
+@contextlib.contextmanager
+def _lockedStore(path=None):
+    """Hold an exclusive advisory lock on the shortcuts file (or the
+    given shard file) for changes.
+
+    The lock is on a separate "shortcuts.xml.lock" file, so readers of
+    the shortcuts file never block. If locking is not supported (e.g.
+    on some network filesystems) the change goes ahead unlocked and
+    _rewriteShortcutsXml() falls back to detecting conflicts.
+    """
+    shortcutsXml = path or getShortcutsFile()
+    if not os.path.isdir(os.path.dirname(shortcutsXml)):
+        os.makedirs(os.path.dirname(shortcutsXml))
+    fd = os.open(shortcutsXml + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        locked = False
+        try:
+            if sys.platform.startswith("win"):
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            locked = True
+        except (ImportError, EnvironmentError):
+            pass
+        yield
+    finally:
+        if locked and sys.platform.startswith("win"):
+            import msvcrt
+            os.lseek(fd, 0, 0)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd) # releases a flock
+
+
+def _rewriteShortcutsXml(update, path=None):
+    """Apply a change to the shortcuts file and save it crash-safely.
+
+    "update" is called with the DOM of the current shortcuts file to make
+        the change. It may raise a GoError to abort.
+    "path" is the shortcuts file to change. It defaults to the user's
+        shortcuts file (see getShortcutsFile()).
+
+    The new content is written to a temporary file, fsync'd and renamed
+    over the shortcuts file, so readers only ever see a complete file and
+    a crash cannot leave a truncated one. If the shortcuts file changed
+    while the update was made (possible only if locking failed) the
+    change is re-applied to the new content, merging with the concurrent
+    change. Call this holding _lockedStore(). Returns the return value
+    of "update".
+    """
+    shortcutsXml = path or getShortcutsFile()
+    for attempt in range(_gMaxWriteAttempts):
+        stamp = _getFileStamp(shortcutsXml)
+        if stamp is not None:
+            dom = xml.dom.minidom.parse(shortcutsXml)
+        else:
+            dom = xml.dom.minidom.parseString(
+                        '<shortcuts version="1.0"></shortcuts>')
+        result = update(dom)
+
+        tmpPath = "%s.%d.tmp" % (shortcutsXml, os.getpid())
+        fout = open(tmpPath, 'wb')
+        try:
+            fout.write(dom.toxml("utf-8"))
+            fout.flush()
+            os.fsync(fout.fileno())
+        finally:
+            fout.close()
+        if _getFileStamp(shortcutsXml) != stamp:
+            os.remove(tmpPath)
+            continue
+        os.replace(tmpPath, shortcutsXml)
+        if hasattr(os, "O_DIRECTORY"):
+            # Make the rename itself durable.
+            try:
+                dirFd = os.open(os.path.dirname(shortcutsXml),
+                                os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(dirFd)
+                finally:
+                    os.close(dirFd)
+            except EnvironmentError:
+                pass
+        return result
+    raise GoError("could not update '%s': it is being changed too often"
+                  % shortcutsXml)
+
+
+def _stampVersion(dom, elem):
+    """Record a change to the given shortcut (or tombstone) element.
+
+    This bumps the store version ("seq" on the root) and sets the
+    element's "seq", "mtime" (kept increasing) and "origin".
+    """
+    import time
+    import socket
+    root = dom.documentElement
+    seq = int(root.getAttribute("seq") or 0) + 1
+    root.setAttribute("seq", str(seq))
+    elem.setAttribute("seq", str(seq))
+    mtime = max(time.time(), float(elem.getAttribute("mtime") or 0) + 1e-6)
+    elem.setAttribute("mtime", "%.6f" % mtime)
+    elem.setAttribute("origin", socket.gethostname())
+
+
+def _versionKey(elem):
+    """Return a sort key for versions of a shortcut element, used to
+    deterministically pick the winner of concurrent changes.
+    """
+    attrs = sorted((k, v) for k, v in elem.attributes.items() if k != "seq")
+    return (float(elem.getAttribute("mtime") or 0),
+            elem.getAttribute("origin"),
+            elem.tagName == "shortcut",
+            attrs,
+            [n.toxml() for n in elem.childNodes
+             if n.nodeType == n.ELEMENT_NODE])
+
+
+def _getFileStamp(path):
+    """Return a value that changes whenever the given file does, or None
+    if it does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _getPickSources(query):
+    """Return the candidate sources for `go --pick <query>', fastest
+    first (see pickPath()).
+    """
+    shortcuts = getShortcuts()
+    query = query.lower()
+
+    def fromShortcuts():
+        names = [n for n in shortcuts if query in n.lower()]
+        names.sort(key=lambda n: (not n.lower().startswith(query), len(n),
+                                  n))
+        for name in names:
+            try:
+                yield name, resolvePath(name, shortcuts)
+            except (KeyError, GoError):
+                pass
+
+    def matchingSubdirs(parents):
+        for label, parent in parents:
+            try:
+                with os.scandir(parent) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except EnvironmentError:
+                continue
+            for entry in entries:
+                if query in entry.name.lower() and entry.is_dir():
+                    yield label + '/' + entry.name, entry.path
+
+    def fromShortcutDirs():
+        # The dirs one level under each shortcut target.
+        targets = {}
+        for name in sorted(shortcuts, key=len):
+            try:
+                target = resolvePath(name, shortcuts)
+            except (KeyError, GoError):
+                continue
+            if os.path.isabs(target):
+                targets.setdefault(target, name)
+        parents = [(name, target) for target, name in targets.items()]
+        return matchingSubdirs(sorted(parents))
+
+    def fromSearchRoots():
+        roots = [r for r in os.environ.get("GO_CDPATH", "").split(
+                 os.pathsep) if r]
+        return matchingSubdirs((r, expanduser(r)) for r in roots)
+
+    sources = [fromShortcuts]
+    if query:
+        sources += [fromSearchRoots, fromShortcutDirs]
+    return sources
+
+
+def _isInteractive():
+    """Return True iff 'go' is being run by a user at a terminal (so
+    pickPath() can be used).
+    """
+    try:
+        return sys.stdin.isatty() and sys.stderr.isatty() \
+               and not sys.platform.startswith("win")
+    except (AttributeError, ValueError):
+        return False
+
+
+def _humanSize(size):
+    """Return the given number of bytes in a short human readable form,
+    e.g. "1.5G".
+    """
+    for unit in "BKMGT":
+        if size < 1024 or unit == "T":
+            break
+        size /= 1024.0
+    if unit == "B":
+        return "%d" % size
+    return "%.1f%s" % (size, unit)
+
+
+def _getSuggestionTree(shortcuts, maxUpdates=_gMaxInlineSuggestionUpdates):
+    """Return the BK-tree of shortcut names used by suggestShortcuts() as
+    (<words>, <children>).
+
+    "shortcuts" is the user's shortcut dictionary (from getShortcuts()):
+        the tree is cached against the shortcuts file.
+
+    "maxUpdates" is the max number of names to add to the saved tree to
+        bring it up to date. If more are needed then an update is started
+        in the background (see `go --update-suggestions') and the
+        out-of-date tree is returned. None means no limit.
+
+    Node i of the tree is words[i] and children[i] is None or a dict
+    mapping edit distance to child node. Node 0 is the root. Names of
+    removed shortcuts are left in the tree (callers must check that a
+    found word is still a shortcut) unless there are so many that it is
+    worth rebuilding.
+    """
+    stamp = _getStoreStamp()
+    cached = _readCache("suggestions")
+    if cached is not None and cached[0] == stamp:
+        return cached[1:]
+    if cached is not None:
+        words, children = cached[1:]
+    else:
+        words, children = [], []
+    names = set(shortcuts)
+    if len(words) > 2 * len(names) + 100:
+        words, children = [], []
+    newNames = names.difference(words)
+    if maxUpdates is not None and len(newNames) > maxUpdates:
+        import time
+        pending = join(_getCacheDir(), "suggestions.pending")
+        try:
+            age = time.time() - os.stat(pending).st_mtime
+        except EnvironmentError:
+            age = None
+        if age is None or age > 600:
+            try:
+                open(pending, 'w').close()
+            except EnvironmentError:
+                pass
+            _startInBackground("--update-suggestions")
+        return words, children
+
+    _addSuggestionWords(words, children, newNames)
+    _writeCache("suggestions", (stamp, words, children))
+    if maxUpdates is None:
+        try:
+            os.remove(join(_getCacheDir(), "suggestions.pending"))
+        except EnvironmentError:
+            pass
+    return words, children
+
+
+def _addSuggestionWords(words, children, names):
+    """Add the given names to the BK-tree (<words>, <children>) (see
+    _getSuggestionTree()), in place.
+    """
+    for word in sorted(names):
+        index = len(words)
+        words.append(word)
+        children.append(None)
+        if not index:
+            continue
+        masks, length = _charMasks(word), len(word)
+        node = 0
+        while True:
+            dist = _editDistance(masks, length, words[node])
+            kids = children[node]
+            if kids is None:
+                children[node] = {dist: index}
+                break
+            elif dist not in kids:
+                kids[dist] = index
+                break
+            node = kids[dist]
+
+
+def _charMasks(s):
+    """Return a dict mapping each char of the given string to the bitmask
+    of its positions in the string, for _editDistance().
+    """
+    masks = {}
+    bit = 1
+    for ch in s:
+        masks[ch] = masks.get(ch, 0) | bit
+        bit <<= 1
+    return masks
+
+
+def _editDistance(masks, length, s):
+    """Return the Levenshtein distance between a string (given by its
+    _charMasks() and length) and the string "s".
+
+    This is Myers' bit-parallel algorithm (as formulated by Hyyrö), which
+    does a handful of integer operations per char of "s" rather than a
+    row of the full dynamic programming table.
+    """
+    if not length:
+        return len(s)
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    pv, mv, dist = full, 0, length
+    get = masks.get
+    for ch in s:
+        eq = get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            dist += 1
+        elif mh & last:
+            dist -= 1
+        ph = (ph << 1) | 1
+        pv = ((mh << 1) | ~(xv | ph)) & full
+        mv = ph & xv
+    return dist
+
+
+def _resolveWorktree(dir, branchPath):
+    """Return the (<dir>, <subpath>) for the given <branch>[/<subpath>]
+    in the git worktree of the given dir's checkout for <branch>.
+
+    <dir> is the same dir relative to the worktree as the given dir is
+    to its checkout. The worktrees are found by reading the repository's
+    "worktrees/*/HEAD" and "gitdir" files rather than by running git (see
+    _getWorktrees()). Raises a GoError if the dir is not in a git
+    checkout or there is no worktree for the branch.
+    """
+    topDir = dir = os.path.abspath(dir)
+    while not os.path.exists(join(topDir, ".git")):
+        parent = os.path.dirname(topDir)
+        if parent == topDir:
+            raise GoError("'%s' is not in a git checkout" % dir)
+        topDir = parent
+    gitDir = join(topDir, ".git")
+    if os.path.isfile(gitDir):
+        # A linked worktree: ".git" is a "gitdir: <path>" file.
+        gitDir = _readGitFile(gitDir)
+        if gitDir.startswith("gitdir:"):
+            gitDir = os.path.normpath(join(topDir, gitDir[7:].strip()))
+        commonDir = _readGitFile(join(gitDir, "commondir"))
+        if commonDir:
+            gitDir = os.path.normpath(join(gitDir, commonDir))
+
+    worktrees = _getWorktrees(gitDir)
+    # Branch names can contain '/', so find the longest one that matches.
+    parts = branchPath.replace('\\', '/').split('/')
+    for i in range(len(parts), 0, -1):
+        branch = '/'.join(parts[:i])
+        if branch in worktrees:
+            relDir = os.path.relpath(dir, topDir)
+            worktree = os.path.normpath(join(worktrees[branch], relDir))
+            return worktree, '/'.join(parts[i:])
+    raise GoError("no worktree for branch '%s' of '%s'"
+                  % (branchPath, topDir))
+
+
+def _getWorktrees(gitDir):
+    """Return a dict mapping branch names to worktree dirs for the given
+    repository (main) git dir.
+
+    The dict is cached, keyed by the mtimes of the git dir (changes when
+    the main checkout's HEAD does) and the "worktrees" dir (changes when
+    a worktree is added or removed) and its entries.
+    """
+    worktreesDir = join(gitDir, "worktrees")
+    try:
+        ids = sorted(os.listdir(worktreesDir))
+    except EnvironmentError:
+        ids = []
+    stamp = [_getFileStamp(gitDir), _getFileStamp(worktreesDir)]
+    stamp += [_getFileStamp(join(worktreesDir, id)) for id in ids]
+    cache = _readCache("worktrees") or {}
+    if gitDir in cache and cache[gitDir][0] == stamp:
+        return cache[gitDir][1]
+
+    worktrees = {}
+    def addWorktree(headPath, dir):
+        head = _readGitFile(headPath)
+        if head.startswith("ref: refs/heads/"):
+            worktrees[head[16:]] = dir
+    if os.path.basename(gitDir) == ".git":
+        addWorktree(join(gitDir, "HEAD"), os.path.dirname(gitDir))
+    for id in ids:
+        # "gitdir" is the path to the ".git" file in the worktree.
+        worktreeGitFile = _readGitFile(join(worktreesDir, id, "gitdir"))
+        if worktreeGitFile:
+            addWorktree(join(worktreesDir, id, "HEAD"),
+                        os.path.dirname(worktreeGitFile))
+    cache[gitDir] = (stamp, worktrees)
+    _writeCache("worktrees", cache)
+    return worktrees
+
+
+def _readGitFile(path):
+    """Return the stripped content of the given one-line git file, or ''
+    if it cannot be read.
+    """
+    try:
+        f = open(path, encoding="utf-8", errors="surrogateescape")
+    except EnvironmentError:
+        return ''
+    try:
+        return f.read().strip()
+    finally:
+        f.close()
+
+
+def _searchRoots(name):
+    """Return the first <root>/<name> dir for the $GO_CDPATH search roots,
+    or None if there is none.
+
+    The roots may be slow network mounts, so they are probed in parallel
+    and the result (hit or miss) is cached for a short while.
+    """
+    roots = tuple(r for r in os.environ.get("GO_CDPATH", "").split(
+        os.pathsep) if r)
+    if not roots:
+        return None
+    key = (roots, name)
+    if key in _gSearchRootResults:
+        return _gSearchRootResults[key]
+
+    import time
+    now = time.time()
+    cache = _readCache("cdpath") or {}
+    if key in cache:
+        checked, hit = cache[key]
+        if now - checked < (hit and _gSearchRootHitTTL
+                            or _gSearchRootMissTTL):
+            _gSearchRootResults[key] = hit
+            return hit
+
+    candidates = [join(expanduser(root), name) for root in roots]
+    hit = None
+    if len(candidates) == 1:
+        if os.path.isdir(candidates[0]):
+            hit = candidates[0]
+    else:
+        # Take the first hit in priority order: a hit under a later root
+        # is only used once all earlier roots have missed.
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(min(len(candidates), 8))
+        try:
+            futures = [executor.submit(os.path.isdir, c)
+                       for c in candidates]
+            for candidate, future in zip(candidates, futures):
+                if future.result():
+                    hit = candidate
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    cache = dict((k, v) for k, v in cache.items()
+                 if now - v[0] < _gSearchRootHitTTL)
+    cache[key] = (now, hit)
+    _writeCache("cdpath", cache)
+    _gSearchRootResults[key] = hit
+    return hit
+
+
+def _getPluginManifest():
+    """Return a dict mapping each resolver plugin scheme to how to load
+    its resolver: ("file", <path>) or ("entrypoint", "<module>:<attr>").
+
+    Finding entry points is slow, so the manifest is cached and only
+    rebuilt when the plugins dir or a sys.path dir changes (as when a
+    package is installed). No plugin module is imported here.
+    """
+    pluginsDir = join(os.path.dirname(getShortcutsFile()), "plugins")
+    stamp = [_getFileStamp(pluginsDir)]
+    for dir in sys.path:
+        stamp.append(os.path.isdir(dir or os.curdir)
+                     and _getFileStamp(dir or os.curdir) or None)
+    cached = _readCache("plugins")
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    manifest = {}
+    try:
+        from importlib.metadata import entry_points
+        eps = entry_points()
+        if hasattr(eps, "select"):
+            eps = eps.select(group="go.resolvers")
+        else:
+            eps = eps.get("go.resolvers", [])
+        for ep in eps:
+            manifest[ep.name] = ("entrypoint", ep.value)
+    except ImportError:
+        pass
+    if os.path.isdir(pluginsDir):
+        for fname in os.listdir(pluginsDir):
+            scheme, ext = os.path.splitext(fname)
+            if ext == ".py" and len(scheme) > 1:
+                manifest[scheme] = ("file", join(pluginsDir, fname))
+    _writeCache("plugins", (stamp, manifest))
+    return manifest
+
+
+def _getRules(shortcuts):
+    """Return a dict mapping the name of each computed shortcut to its
+    (<kind>, <glob>, <ttl>) rule.
+
+    The rules are read from the shortcuts file in one pass and cached.
+    They are kept in memory for the given shortcuts dictionary, so this
+    is cheap to call for every lookup.
+    """
+    global _gRules
+    if _gRules is not None and _gRules[0] is shortcuts:
+        return _gRules[1]
+    stamp = _getStoreStamp()
+    cached = _readCache("rules")
+    if cached is not None and cached[0] == stamp:
+        rules = cached[1]
+    else:
+        rules = {}
+        shortcutsXml = getShortcutsFile()
+        if os.path.isfile(shortcutsXml):
+            for elem in _iterShortcutsXml(shortcutsXml):
+                if elem.tag == "shortcut" and elem.get("rule"):
+                    try:
+                        ttl = float(elem.get("ttl") or _gRuleTTL)
+                    except ValueError:
+                        ttl = _gRuleTTL
+                    rules[elem.get("name")] = (elem.get("rule"),
+                                               elem.get("match"), ttl)
+        _writeCache("rules", (stamp, rules))
+    _gRules = (shortcuts, rules)
+    return rules
+
+
+def _evalRule(name, value, kind, glob, ttl):
+    """Return the target of the named computed shortcut.
+
+    "value" is the shortcut's (expanded) value and "kind" the kind of
+    rule:
+        newest      the most recently modified subdir of <value>
+        greatest    the subdir of <value> with the (lexically) greatest
+                    name
+        date        <value> is a strftime() template, e.g.
+                    "/var/log/%Y-%m-%d"
+    "glob" optionally restricts the subdirs considered by "newest" and
+        "greatest" to those with matching names.
+
+    A computed target is cached and reused for "ttl" seconds (as long as
+    the rule is the same). Raises a GoError if there is no target.
+    """
+    import time
+    now = time.time()
+    key = (name, value, kind, glob)
+    cache = _readCache("computed") or {}
+    if key in cache and now - cache[key][0] < ttl:
+        return cache[key][1]
+
+    if kind == "date":
+        target = time.strftime(value, time.localtime(now))
+    elif kind in ("newest", "greatest"):
+        from fnmatch import fnmatch
+        best = bestKey = None
+        try:
+            with os.scandir(value) as it:
+                for entry in it:
+                    if glob and not fnmatch(entry.name, glob):
+                        continue
+                    try:
+                        if not entry.is_dir():
+                            continue
+                        if kind == "newest":
+                            entryKey = (entry.stat().st_mtime, entry.name)
+                        else:
+                            entryKey = entry.name
+                    except EnvironmentError:
+                        continue
+                    if bestKey is None or entryKey > bestKey:
+                        best, bestKey = entry.path, entryKey
+        except EnvironmentError as ex:
+            raise GoError("could not compute '%s': %s" % (name, ex))
+        if best is None:
+            raise GoError("could not compute '%s': no%s dirs in '%s'"
+                          % (name, glob and " '%s'" % glob or "", value))
+        target = best
+    else:
+        raise GoError("shortcut '%s' has an unknown rule: '%s'"
+                      % (name, kind))
+
+    cache = dict((k, v) for k, v in cache.items() if now - v[0] < 86400)
+    cache[key] = (now, target)
+    _writeCache("computed", cache)
+    return target
+
+
+def _expandPatternShortcut(name, namespace=None):
+    """Return the target of the given name from the first pattern
+    shortcut matching it (see _getPatternMatcher()).
+
+    Only group references in the pattern's value are replaced, unlike
+    with match.expand(), so other backslashes are kept: e.g. the value
+    "D:\\work\\t\\\\1" gives "D:\\work\\t\\<group 1>".
+
+    Raises a KeyError if no pattern matches (pattern shortcuts are not
+    supported in namespaces).
+    """
+    if namespace is None:
+        combined, patterns = _getPatternMatcher()
+        if combined is not None:
+            match = combined.fullmatch(name)
+            # The empty group after the winning pattern is the last matched.
+            candidates = match and [patterns[match.lastindex]] or []
+        else:
+            candidates = patterns.values()
+        for regex, value in candidates:
+            match = regex.fullmatch(name)
+            if match:
+                def group(ref):
+                    num, groupName = ref.groups()
+                    return match.group(num and int(num) or groupName) or ""
+                try:
+                    return _gGroupRefRe.sub(group, value)
+                except IndexError as ex:
+                    raise GoError("bad value for pattern shortcut '%s': %s"
+                                  % (regex.pattern, ex))
+    raise KeyError(name)
+
+
+def _getPatternMatcher():
+    """Return the (<combined regex>, <patterns>) for the pattern shortcuts
+    in the shortcuts file:
+
+        <pattern match="<regex>" value="<value with \1 etc.>"/>
+
+    All patterns are tried with one match of <combined regex>: an
+    alternation of the patterns in document order, each followed by an
+    empty marker group to tell which one matched. (Wrapping each pattern
+    in a group instead makes the match an order of magnitude slower.)
+    <patterns> is a dict mapping the number of each pattern's marker
+    group to its (<compiled regex>, <value>). Leading inline flags of a
+    pattern (e.g. "(?i)") are scoped to it (see _scopeInlineFlags()). If
+    the patterns cannot be combined (e.g. one uses named groups or
+    backreferences) <combined regex> is None and each pattern must be
+    tried in turn.
+
+    The patterns are cached against the shortcuts file and compiled once
+    per process.
+    """
+    global _gPatternMatcher
+    stamp = _getStoreStamp()
+    if _gPatternMatcher is not None and _gPatternMatcher[0] == stamp:
+        return _gPatternMatcher[1:]
+
+    cached = _readCache("patterns")
+    if cached is not None and cached[0] == stamp:
+        sources = cached[1]
+    else:
+        sources = []
+        shortcutsXml = getShortcutsFile()
+        if os.path.isfile(shortcutsXml):
+            for elem in _iterShortcutsXml(shortcutsXml):
+                if elem.tag == "pattern" and elem.get("match"):
+                    sources.append((elem.get("match"), elem.get("value", "")))
+        _writeCache("patterns", (stamp, sources))
+
+    patterns = {}
+    group = 0
+    for source, value in sources:
+        try:
+            regex = re.compile(source)
+        except re.error:
+            continue # a bad pattern never matches
+        group += regex.groups + 1
+        patterns[group] = (regex, value)
+    combined = None
+    if patterns and not [p for p, v in sources
+                         if re.search(r"\\[1-9]|\(\?P[<=]|\(\?\(", p)]:
+        try:
+            combined = re.compile('|'.join(
+                "%s()" % _scopeInlineFlags(regex.pattern)
+                for regex, value in patterns.values()))
+        except re.error:
+            pass
+    _gPatternMatcher = (stamp, combined, patterns)
+    return combined, patterns
+
+
+def _scopeInlineFlags(source):
+    """Return the given regex source as a group, with its leading inline
+    flags (if any) scoped to the group: "(?i)abc" -> "(?i:abc)".
+
+    Global inline flags are only allowed at the start of a regex, so
+    this lets flagged patterns be combined into one alternation.
+    """
+    match = re.match(r"(?:\(\?[aiLmsux]+\))+", source)
+    if match is None:
+        return "(?:%s)" % source
+    flags = "".join(sorted(set(re.sub(r"[(?)]", "", match.group(0)))))
+    rest = source[match.end():]
+    if 'x' in flags:
+        rest += "\n" # end a trailing comment before the ')'
+    return "(?%s:%s)" % (flags, rest)
+
+
+def _getSchemeResolver(scheme):
+    """Return the resolve() callable of the plugin for the given scheme,
+    importing it if necessary, or None if there is no such plugin.
+    """
+    try:
+        kind, where = _getPluginManifest()[scheme]
+    except KeyError:
+        return None
+    try:
+        if kind == "file":
+            import importlib.util
+            spec = importlib.util.spec_from_file_location(
+                "go_plugin_" + scheme, where)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module.resolve
+        else:
+            import importlib
+            moduleName, attr = where.split(':', 1)
+            obj = importlib.import_module(moduleName.strip())
+            for part in attr.strip().split('.'):
+                obj = getattr(obj, part)
+            return obj
+    except Exception as ex:
+        raise GoError("could not load '%s' resolver plugin (%s): %s"
+                      % (scheme, where, ex))
+
+
+def _getLogicalRoots():
+    """Return a list of (<logical>, <physical>) dir pairs for symlinked
+    dirs whose logical path should be preferred (currently just $HOME).
+    """
+    roots = []
+    home = os.environ.get("HOME")
+    if home and os.path.isabs(home):
+        logical = os.path.normpath(home)
+        physical = _realpath(logical)
+        if physical != logical:
+            roots.append((logical, physical))
+    return roots
+
+
+def _getLogicalCwd():
+    """Return the current dir as the shell sees it.
+
+    os.getcwd() gives the physical path (all symlinks resolved), so
+    prefer $PWD if it is the same dir.
+    """
+    cwd = os.getcwd()
+    pwd = os.environ.get("PWD")
+    if pwd and pwd != cwd and os.path.isabs(pwd):
+        try:
+            if os.path.samefile(pwd, cwd):
+                return pwd
+        except EnvironmentError:
+            pass
+    return cwd
+
+
+def _realpath(path):
+    """Return os.path.realpath(path) using a small persisted cache.
+
+    Resolving symlinks costs a syscall per path component. A cache
+    entry records the symlinks found along the path and their targets,
+    and is only used while those links still point at the same targets
+    and the resolved path still exists.
+    """
+    global _gRealpaths
+    if _gRealpaths is None:
+        _gRealpaths = _readCache("realpaths") or {}
+    entry = _gRealpaths.get(path)
+    if entry is not None:
+        real, links = entry
+        try:
+            for link, target in links:
+                if os.readlink(link) != target:
+                    break
+            else:
+                if os.path.exists(real):
+                    return real
+        except EnvironmentError:
+            pass
+
+    links = []
+    prefix = os.path.abspath(path)
+    while True:
+        if os.path.islink(prefix):
+            try:
+                links.append((prefix, os.readlink(prefix)))
+            except EnvironmentError:
+                pass
+        head = os.path.dirname(prefix)
+        if head == prefix:
+            break
+        prefix = head
+    real = os.path.realpath(path)
+
+    _gRealpaths.pop(path, None)
+    _gRealpaths[path] = (real, links)
+    while len(_gRealpaths) > _gRealpathCacheSize:
+        del _gRealpaths[next(iter(_gRealpaths))]
+    _writeCache("realpaths", _gRealpaths)
+    return real
+
+
+def _getStoreStamp(namespace=None):
+    """Return a value that changes whenever the shortcuts (or those of
+    the given namespace) do.
+
+    This is used to validate caches derived from the shortcuts.
+    """
+    if namespace is not None:
+        return (_getFileStamp(_getShardFile(namespace)),)
+    stamp = [_getFileStamp(getShortcutsFile()),
+             _getFileStamp(join(_getCacheDir(), "catalog.pickle"))]
+    if stamp[1] is not None:
+        # The catalog cache is only ever replaced (changing the inode)
+        # when its content changes, but it is touched on every refresh.
+        stamp[1] = stamp[1][1:]
+    return tuple(stamp)
+
+
+def _getCacheDir():
+    return join(os.path.dirname(getShortcutsFile()), "cache")
+
+def _readCache(name):
+    """Return the data in the named cache file, or None if there is no
+    such cache (or it cannot be read).
+    """
+    path = join(_getCacheDir(), name + ".pickle")
+    try:
+        f = open(path, 'rb')
+    except EnvironmentError:
+        return None
+    try:
+        return pickle.load(f)
+    except Exception:
+        # A corrupt or incompatible cache is just a cache miss.
+        return None
+    finally:
+        f.close()
+
+def _writeCache(name, data):
+    """Save data to the named cache file.
+
+    The file is written to a temporary file and renamed into place so
+    that concurrent readers never see a partial cache. Failure to write
+    a cache is not an error.
+    """
+    dname = _getCacheDir()
+    path = join(dname, name + ".pickle")
+    tmpPath = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        if not os.path.isdir(dname):
+            os.makedirs(dname)
+        f = open(tmpPath, 'wb')
+        try:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.replace(tmpPath, path)
+    except EnvironmentError:
+        try:
+            os.remove(tmpPath)
+        except EnvironmentError:
+            pass
+
+
+def _iterRecordBatches(fin, sep, bufsize=65536):
+    """Generate lists of the "sep"-separated records read from binary
+    file "fin": the complete records from each read of the file.
+
+    A trailing separator does not produce an empty last record.
+    """
+    tail = b''
+    while 1:
+        chunk = fin.read1(bufsize) if hasattr(fin, "read1") \
+                else fin.read(bufsize)
+        if not chunk:
+            break
+        records = (tail + chunk).split(sep)
+        tail = records.pop()
+        if records:
+            yield records
+    if tail:
+        yield [tail]
+
+
 def _normpath(path):
     from os.path import normcase, normpath
     n = normcase(normpath(path))
@@ -590,27 +3787,49 @@ def _normpath(path):
 
 #---- mainline
 
+# Options for actions that never change the shell's directory. These can
+# be run without the shell driver (e.g. from scripts).
+_gStandaloneOpts = ["--resolve", "-w", "--whereami", "--prompt-func",
+                    "--refresh-catalog", "--sync-export", "--sync-apply",
+                    "--warm", "--update-suggestions", "--each", "--du",
+                    "--shorten"]
+
 def main(argv):
     # Must write out a no-op shell script before any error can happen
     # otherwise the script from the previous run could result.
     try:
         shellScript = os.environ[_envvar]
     except KeyError:
+        shellScript = None
         if _subsystem == "windows":
             pass # Don't complain about missing console setup.
-        return setup()
+        if not [a for a in argv[1:] if a in _gStandaloneOpts]:
+            return setup()
     else:
         generateShellScript(shellScript) # no-op, overwrite old one
 
     # Parse options
     try:
-        shortopts = "hVcsadl"
+        shortopts = "hVcsadl0ewt:g:n:j:"
         longopts = ['help', 'version', 'cd', 'set', 'add-current',
-                    'delete', 'list']
+                    'delete', 'list', 'resolve', 'null', 'env', 'whereami',
+                    'prompt-func', 'subscribe', 'unsubscribe',
+                    'refresh-catalog', 'tag=', 'group=', 'sync-export',
+                    'sync-apply', 'namespace=', 'warm', 'depth=',
+                    'timeout=', 'find=', 'update-suggestions', 'pick',
+                    'each', 'jobs=', 'rule=', 'ttl=', 'du', 'sort=',
+                    'shorten']
         if sys.platform.startswith("win"):
             shortopts += "o"
             longopts.append("open")
-        optlist, args = getopt.getopt(argv[1:], shortopts, longopts)
+        # Options can come after arguments ("go repo --find '*.py' -j 4")
+        # but everything after "--" is an argument (the --each command).
+        if "--" in argv[1:]:
+            i = argv.index("--", 1)
+            optargv, rest = argv[1:i], argv[i+1:]
+        else:
+            optargv, rest = argv[1:], None
+        optlist, args = getopt.gnu_getopt(optargv, shortopts, longopts)
     except getopt.GetoptError as ex:
         msg = ex.msg
         if ex.opt in ('d', 'dump'):
@@ -619,6 +3838,14 @@ def main(argv):
         sys.stderr.write("See 'go --help'.\n")
         return 1
     action = "cd"
+    sep = '\n'
+    tags, group = [], None
+    namespace = None
+    depth = timeout = jobs = None
+    findPattern = None
+    rule = None
+    ruleTTL = None
+    sortBy = "size"
     for opt, optarg in optlist:
         if opt in ('-h', '--help'):
             sys.stdout.write(__doc__)
@@ -638,15 +3865,97 @@ def main(argv):
             action = "list"
         elif opt in ("-o", "--open"):
             action = "open"
+        elif opt == "--resolve":
+            action = "resolve"
+        elif opt in ("-0", "--null"):
+            sep = '\0'
+        elif opt in ("-e", "--env"):
+            action = "env"
+        elif opt in ("-w", "--whereami"):
+            action = "whereami"
+        elif opt == "--prompt-func":
+            action = "prompt-func"
+        elif opt == "--subscribe":
+            action = "subscribe"
+        elif opt == "--unsubscribe":
+            action = "unsubscribe"
+        elif opt == "--refresh-catalog":
+            action = "refresh-catalog"
+        elif opt == "--sync-export":
+            action = "sync-export"
+        elif opt == "--sync-apply":
+            action = "sync-apply"
+        elif opt in ("-t", "--tag"):
+            tags.append(optarg)
+        elif opt in ("-g", "--group"):
+            group = optarg
+        elif opt in ("-n", "--namespace"):
+            namespace = optarg
+        elif opt == "--warm":
+            action = "warm"
+        elif opt == "--update-suggestions":
+            action = "update-suggestions"
+        elif opt == "--pick":
+            action = "pick"
+        elif opt == "--find":
+            action = "find"
+            findPattern = optarg
+        elif opt == "--each":
+            action = "each"
+        elif opt == "--du":
+            action = "du"
+        elif opt == "--shorten":
+            action = "shorten"
+        elif opt == "--sort":
+            if optarg not in ("size", "name"):
+                error("invalid --sort value: '%s' (must be 'size' or "
+                      "'name')" % optarg)
+                return 1
+            sortBy = optarg
+        elif opt == "--rule":
+            kind, colon, glob = optarg.partition(':')
+            rule = kind != "none" and (kind, glob or None) or ()
+        elif opt == "--ttl":
+            try:
+                ruleTTL = float(optarg)
+            except ValueError:
+                error("invalid --ttl value: '%s'" % optarg)
+                return 1
+        elif opt == "--depth":
+            try:
+                depth = int(optarg)
+            except ValueError:
+                error("invalid %s value: '%s'" % (opt, optarg))
+                return 1
+        elif opt == "--timeout":
+            try:
+                timeout = float(optarg)
+            except ValueError:
+                error("invalid %s value: '%s'" % (opt, optarg))
+                return 1
+        elif opt in ("-j", "--jobs"):
+            try:
+                jobs = int(optarg)
+            except ValueError:
+                error("invalid %s value: '%s'" % (opt, optarg))
+                return 1
+            if jobs < 1:
+                error("invalid %s value: '%s' (must be at least 1)"
+                      % (opt, optarg))
+                return 1
+    if rest is not None:
+        if action == "each":
+            args.append("--")
+        args += rest
 
     # Parse arguments and do specified action.
     if action == "add":
         if len(args) != 1:
             error("Incorrect number of arguments. argv: %s" % argv)
             return 1
-        name, value = args[0], os.getcwd()
+        name, value = args[0], canonicalPath(_getLogicalCwd())
         try:
-            setShortcut(name, value)
+            setShortcut(name, value, *_tagsAndGroup(name, tags, group))
         except GoError as ex:
             error(str(ex))
             return 1
@@ -667,8 +3976,14 @@ def main(argv):
             error("Incorrect number of arguments. argv: %s" % argv)
             return 1
         name, value = args
+        if os.path.isabs(value):
+            value = canonicalPath(value)
+        if ruleTTL is not None and not rule:
+            error("--ttl can only be used with --rule")
+            return 1
         try:
-            setShortcut(name, value)
+            setShortcut(name, value, *_tagsAndGroup(name, tags, group),
+                        rule=rule and rule + (ruleTTL,))
         except GoError as ex:
             error(str(ex))
             return 1
@@ -683,8 +3998,28 @@ def main(argv):
             try:
                 generateShellScript(shellScript, path)
             except KeyError as ex:
-                error("Unrecognized shortcut: '%s'" % str(ex))
+                tag = ex.args[0]
+                suggestions = suggestShortcuts(tag)
+                if len(suggestions) == 1 and path.startswith(tag) \
+                   and os.environ.get("GO_AUTOCORRECT", "0") != "0":
+                    sys.stderr.write("go: no '%s' shortcut, using '%s'\n"
+                                     % (tag, suggestions[0]))
+                    return main([argv[0], suggestions[0] + path[len(tag):]])
+                elif suggestions:
+                    error("Unrecognized shortcut: '%s' (did you mean %s?)"
+                          % (tag, " or ".join("'%s'" % s
+                                              for s in suggestions)))
+                else:
+                    error("Unrecognized shortcut: '%s'" % tag)
                 return 1
+            except AmbiguousPathError as ex:
+                if not _isInteractive():
+                    error("%s:\n  %s" % (ex, "\n  ".join(ex.candidates)))
+                    return 1
+                picked = pickPath([lambda: (("", c) for c in ex.candidates)])
+                if picked is None:
+                    return 1
+                generateShellScript(shellScript, picked)
             except GoError as ex:
                 error(str(ex))
                 return 1
@@ -713,19 +4048,268 @@ def main(argv):
             return 1
 
     elif action == "list":
-        if len(args) == 0:
-            printShortcuts(getShortcuts())
-        elif len(args) == 1:
-            pattern = args[0].lower()
+        if len(args) > 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        subheaders = []
+        if namespace is not None:
+            if tags or group:
+                error("cannot use --tag or --group with --namespace")
+                return 1
+            try:
+                shortcuts = getShortcuts(namespace)
+            except GoError as ex:
+                error(str(ex))
+                return 1
+            shortcuts = dict((namespace + ':' + n, v)
+                             for n, v in shortcuts.items())
+            subheaders.append("Namespace '%s'" % namespace)
+        else:
             shortcuts = getShortcuts()
+        if tags or group:
+            # Answer from the tag index rather than scanning.
+            index = getTagIndex()
+            memberSets = []
+            for tag in tags:
+                memberSets.append(index["tags"].get(tag, set()))
+                subheaders.append("Tagged '%s'" % tag)
+            if group:
+                memberSets.append(index["groups"].get(group, set()))
+                subheaders.append("Group '%s'" % group)
+            names = set.intersection(*memberSets)
+            shortcuts = dict((n, shortcuts[n]) for n in names
+                             if n in shortcuts)
+        if args:
+            pattern = args[0].lower()
             s = {}
             for name, value in shortcuts.items():
                 if name.lower().find(pattern) != -1:
                     s[name] = value
-            printShortcuts(s, "Matching '%s'" % pattern)
+            shortcuts = s
+            subheaders.append("Matching '%s'" % pattern)
+        printShortcuts(shortcuts, ", ".join(subheaders) or None)
+
+    elif action == "env":
+        if len(args) < 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        name, settings = args[0], args[1:]
+        if not settings:
+            for kind, varName, value in getShortcutEnv(name):
+                if kind == "source":
+                    print("source:%s" % value)
+                elif kind == "path":
+                    print("%s+=%s" % (varName, value))
+                elif value is None:
+                    print("-%s" % varName)
+                else:
+                    print("%s=%s" % (varName, value))
+            return 0
+        try:
+            if settings == ["-"]:
+                profile = []
+            else:
+                profile = getShortcutEnv(name) \
+                          + [_parseEnvSetting(s) for s in settings]
+            setShortcutEnv(name, profile)
+        except GoError as ex:
+            error(str(ex))
+            return 1
+
+    elif action == "whereami":
+        if len(args) > 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        if args:
+            path = args[0]
+        else:
+            # Prefer the logical current dir as seen by the shell.
+            path = os.environ.get("PWD") or os.getcwd()
+        sys.stdout.write((whereami(path) or path) + '\n')
+
+    elif action == "find":
+        if len(args) != 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        try:
+            root = resolvePath(args[0])
+        except KeyError as ex:
+            error("Unrecognized shortcut: '%s'" % str(ex))
+            return 1
+        except GoError as ex:
+            error(str(ex))
+            return 1
+        matches = findPaths(root, findPattern)
+        if not matches:
+            error("no '%s' found under '%s'" % (findPattern, root))
+            return 1
+        elif len(matches) > 1 and _isInteractive():
+            dir = pickPath([lambda: (("", m) for m in matches)])
+            if dir is None:
+                return 1
+        elif len(matches) > 1:
+            more = len(matches) == _gFindMaxMatches and " or more" or ""
+            error("'%s' matches %d%s paths under '%s':\n  %s"
+                  % (findPattern, len(matches), more, root,
+                     "\n  ".join(matches)))
+            return 1
+        else:
+            dir = matches[0]
+        if not os.path.isdir(dir):
+            dir = os.path.dirname(dir)
+        generateShellScript(shellScript, dir)
+
+    elif action == "pick":
+        if len(args) > 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        try:
+            path = pickPath(_getPickSources(args and args[0] or ""))
+        except GoError as ex:
+            error(str(ex))
+            return 1
+        if path is None:
+            return 1
+        generateShellScript(shellScript, path)
+
+    elif action == "update-suggestions":
+        if args:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        _getSuggestionTree(getShortcuts(), None)
+
+    elif action == "each":
+        if "--" in args:
+            i = args.index("--")
+            patterns, command = args[:i], args[i+1:]
         else:
+            patterns, command = [], args
+        if len(patterns) > 1 or not command:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        failures = []
+        numRun = 0
+        results = runInShortcutDirs(command, patterns and patterns[0] or None,
+                                    jobs, timeout)
+        for name, target, exitCode, output in results:
+            numRun += 1
+            for line in output.decode("utf-8", "replace").splitlines():
+                sys.stdout.write("%s: %s\n" % (name, line))
+            sys.stdout.flush()
+            if exitCode is None:
+                failures.append("%s (timed out)" % name)
+            elif exitCode:
+                failures.append("%s (exit code %d)" % (name, exitCode))
+        sys.stderr.write("go: ran in %d dirs: %d succeeded, %d failed%s\n"
+                         % (numRun, numRun - len(failures), len(failures),
+                            failures and ": " + ", ".join(failures) or ""))
+        if failures:
+            return 1
+
+    elif action == "du":
+        if len(args) > 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        usage, total = getDiskUsage(args and args[0] or None)
+        if sortBy == "size":
+            usage.sort(key=lambda u: -u[2])
+        for name, target, size in usage:
+            sys.stdout.write("%8s  %-20s  %s\n"
+                             % (_humanSize(size), name, target))
+        sys.stdout.write("%8s  total\n" % _humanSize(total))
+
+    elif action == "shorten":
+        if args:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        try:
+            shortenPaths(sys.stdin.buffer, sys.stdout.buffer)
+        except BrokenPipeError:
+            pass
+
+    elif action == "warm":
+        if len(args) > 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        import time
+        start = time.time()
+        numDirs, numEntries = warmShortcuts(args and args[0] or None,
+                                            depth, timeout)
+        sys.stdout.write("warmed %d dirs (%d entries) in %.1fs\n"
+                         % (numDirs, numEntries, time.time() - start))
+
+    elif action == "prompt-func":
+        shell = _getShell()
+        try:
+            sys.stdout.write(_gPromptFuncFromShell[shell])
+        except KeyError:
+            error("no prompt function for your shell: %s" % shell)
+            return 1
+
+    elif action == "subscribe":
+        if len(args) != 1:
             error("Incorrect number of arguments. argv: %s" % argv)
             return 1
+        setCatalogUrl(args[0])
+        try:
+            refreshCatalog(args[0])
+        except GoError as ex:
+            error("%s (will retry in the background)" % ex)
+
+    elif action == "unsubscribe":
+        if args:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        setCatalogUrl(None)
+
+    elif action == "refresh-catalog":
+        if args:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        try:
+            refreshCatalog()
+        except GoError as ex:
+            error(str(ex))
+            return 1
+
+    elif action == "sync-export":
+        if len(args) > 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        try:
+            since = args and int(args[0]) or 0
+        except ValueError:
+            error("invalid store version: '%s'" % args[0])
+            return 1
+        sys.stdout.write(exportChanges(since) + '\n')
+
+    elif action == "sync-apply":
+        if len(args) != 1:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        if args[0] == '-':
+            content = sys.stdin.buffer.read()
+        else:
+            try:
+                content = open(args[0], 'rb').read()
+            except EnvironmentError as ex:
+                error(str(ex))
+                return 1
+        try:
+            numApplied, seq = applyChanges(content)
+        except GoError as ex:
+            error(str(ex))
+            return 1
+        sys.stderr.write("go: applied %d change(s), store version is now "
+                         "%d\n" % (numApplied, seq))
+
+    elif action == "resolve":
+        if args:
+            error("Incorrect number of arguments. argv: %s" % argv)
+            return 1
+        numErrors = resolvePaths(sys.stdin.buffer, sys.stdout.buffer, sep)
+        if numErrors:
+            return 1
 
     elif action == "open" and sys.platform.startswith("win"):
         if len(args) != 1: